@@ -0,0 +1,503 @@
+# Authors: Sebastian Thelen, Patrick Gratz
+# Description: Load-testing and latency benchmark of the Memento service.
+# Synthetic consolidation hierarchies (shaped like consolidation_data.txt) are
+# served by a local stub SPARQL endpoint with configurable latency; the
+# service is driven in-process (or over http, see --url) through the timegate,
+# original resource, intermediate resource, timemap and data routes and
+# latency percentiles, throughput and SPARQL queries per request (counted by
+# the stub endpoint) are reported.
+#
+# Usage: python benchmark.py --hierarchies 100 --depth 2 --width 4 \
+#            --latency 2 --requests 2000 --concurrency 8
+#
+# A deployment (e.g. gunicorn with gevent workers) is measured by starting
+# it against the stub endpoint once the benchmark waits for it:
+#        python benchmark.py --url http://127.0.0.1:5000 --stub-port 8890
+#        python memento.py --workers 4 --bind 127.0.0.1:5000 \
+#            --endpoint http://127.0.0.1:8890/sparql \
+#            --prefix http://publications.europa.eu/resource/celex/
+
+import argparse
+import concurrent.futures
+import datetime
+import json
+import logging
+import multiprocessing
+import random
+import re
+import sys
+import threading
+import time
+import urllib.parse
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from requests import Session
+from requests.exceptions import RequestException
+import localstore
+from httpdate import formatHTTPDate
+import memento
+
+PREFIX = 'http://publications.europa.eu/resource/celex/'
+DATE_DOCUMENT = localstore.CDM + 'work_date_document'
+XSD_DATE = localstore.XSD + 'date'
+FIRST_DATE = datetime.date(2000, 1, 1)
+ROUTES = ['timegate', 'original', 'intermediate', 'timemap', 'data']
+# query templates of memento.py and the backend operations they implement
+OPERATIONS = [
+    ('URI_R_TEMPLATE', 'uriR'),
+    ('DATETIME_PROPERTY_TEMPLATE', 'datetimeProperty'),
+    ('LOCATION_TEMPLATE', 'location'),
+    ('DESCRIBE_TEMPLATE', 'describe'),
+    ('EVOLUTIVE_WORK_TEMPLATE', 'evolutiveWork'),
+    ('MEMENTO_DATETIME_TEMPLATE', 'mementoDatetime'),
+    ('RELATED_EVOLUTIVE_WORKS', 'relatedEvolutiveWorks'),
+    ('RELATED_MEMENTOS', 'relatedMementos'),
+    ('TIMEMAPINFO', 'timemapInfo'),
+    ('TEMPORAL_INDEX_TEMPLATE', 'temporalIndex'),
+    ('CASCADE_TEMPLATE', 'cascade'),
+    ('TIMEMAP_FINGERPRINT_TEMPLATE', 'timemapFingerprints'),
+    ('URI_R_BATCH_TEMPLATE', 'urisR'),
+    ('MEMENTO_DATETIME_BATCH_TEMPLATE', 'mementoDatetimes'),
+    ('COMPLEX_WORK_PREDECESSOR_TEMPLATE', 'predecessors'),
+    ('ANCESTORS_TEMPLATE', 'ancestors'),
+    ('MEMBERS_TEMPLATE', 'members'),
+]
+# patterns of the template parameters
+PARAMETERS = {
+    'uri': '[^<>]*',
+    'uris': '[^{}]*',
+    'accept_datetime': "[^']*",
+    'limit': '[0-9]+',
+    'offset': '[0-9]+',
+}
+
+
+class Hierarchies(object):
+    """synthetic consolidation hierarchies
+
+    every root (original resource) negotiates on cdm:work_date_document over
+    width consolidated versions, evolutive works below negotiate on
+    cdm:work_date_creation; depth is the number of member levels"""
+
+    def __init__(self, count, depth, width):
+        self.triples = []
+        self.roots = []
+        self.works = []  # evolutive works below the roots
+        self.leaves = []
+        self.last_date = FIRST_DATE
+        for n in range(count):
+            root = PREFIX + 'B%05d' % n
+            self.roots.append(root)
+            self.addWork(root, 0, depth, width, DATE_DOCUMENT, None, None)
+
+    def addWork(self, uri, level, depth, width, prop, document, creation):
+        if level > 0:
+            self.last_date = max(self.last_date, document, creation)
+            self.triples.append((uri, DATE_DOCUMENT, localstore.Literal(
+                document.isoformat(), XSD_DATE)))
+            self.triples.append((uri, localstore.DATE_CREATION,
+                                 localstore.Literal(creation.isoformat(),
+                                                    XSD_DATE)))
+        if level == depth:
+            self.leaves.append(uri)
+            return
+        if level > 0:
+            self.works.append(uri)
+        self.triples.append((uri, localstore.RDF_TYPE,
+                             localstore.EVOLUTIVE_WORK))
+        self.triples.append((uri, localstore.DATETIME_NEGOTIATION, prop))
+        for i in range(width):
+            if level == 0:
+                # one consolidated version per year
+                member_document = FIRST_DATE + datetime.timedelta(days=365 * i)
+                member_creation = member_document + datetime.timedelta(days=10)
+            else:
+                member_document = document
+                member_creation = creation + datetime.timedelta(days=30 * i)
+            member = uri + (level + 1 < depth and '-%02d' % i or '_%d' % i)
+            self.triples.append((uri, localstore.HAS_MEMBER, member))
+            self.addWork(member, level + 1, depth, width,
+                         localstore.DATE_CREATION, member_document,
+                         member_creation)
+
+
+class StubEndpoint(object):
+    """local sparql endpoint answering from a LocalStoreBackend after a
+    configurable latency (milliseconds, uniformly jittered)
+
+    the queries of memento.SparqlClient are mapped back to their template
+    and parameters and answered by the corresponding operation of the
+    backend. The endpoint is served by a forked process so that it does not
+    compete with the benchmarked service for the interpreter lock"""
+
+    def __init__(self, backend, latency=0, jitter=0, port=0):
+        self.backend = backend
+        self.handlers = [(compileTemplate(getattr(memento, name)), operation)
+                         for name, operation in OPERATIONS]
+        self.latency = latency
+        self.jitter = jitter
+        self.context = multiprocessing.get_context('fork')
+        self._queries = self.context.Value('l', 0)
+        self.process = None
+        endpoint = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+            # headers and body are written separately
+            disable_nagle_algorithm = True
+
+            def do_GET(self):
+                params = urllib.parse.parse_qs(
+                    urllib.parse.urlparse(self.path).query)
+                status, content_type, body = endpoint.answer(
+                    params.get('query', [''])[0],
+                    params.get('format', ['application/json'])[0])
+                self.send_response(status)
+                self.send_header('Content-Type', content_type)
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        self.server = ThreadingHTTPServer(('127.0.0.1', port), Handler)
+        self.server.daemon_threads = True
+        self.url = 'http://127.0.0.1:%d/sparql' % self.server.server_port
+
+    def answer(self, query, format):
+        """return a tuple (status, content type, body) for a query"""
+        with self._queries.get_lock():
+            self._queries.value += 1
+        delay = self.latency + random.uniform(-self.jitter, self.jitter)
+        if delay > 0:
+            time.sleep(delay / 1000.0)
+        for pattern, operation in self.handlers:
+            match = pattern.fullmatch(query)
+            if match is not None:
+                break
+        else:
+            return 400, 'text/plain', b'unsupported query'
+        args = parseArguments(match.groupdict())
+        if operation == 'describe':
+            args['format'] = format
+        try:
+            result = getattr(self.backend, operation)(**args)
+        except ValueError as e:
+            return 400, 'text/plain', str(e).encode('utf-8')
+        if format == 'application/json':
+            bindings = [dict([(name, {'type': 'literal', 'value': value})
+                              for name, value in row.items()])
+                        for row in result]
+            return 200, 'application/sparql-results+json', json.dumps(
+                {'head': {'vars': []},
+                 'results': {'bindings': bindings}}).encode('utf-8')
+        return 200, format, result.encode('utf-8')
+
+    @property
+    def queries(self):
+        """number of queries answered so far"""
+        return self._queries.value
+
+    def start(self):
+        self.process = self.context.Process(target=self.server.serve_forever)
+        self.process.daemon = True
+        self.process.start()
+
+    def stop(self):
+        self.process.terminate()
+        self.process.join()
+        self.server.server_close()
+
+
+def compileTemplate(template):
+    """compile a regular expression matching the queries of a template"""
+    pattern = re.escape(template)
+    for name, expression in PARAMETERS.items():
+        placeholder = re.escape('%%(%s)s' % name)
+        # repeated parameters must have the same value
+        pattern = pattern.replace(
+            placeholder, '(?P<%s>%s)' % (name, expression), 1).replace(
+            placeholder, '(?P=%s)' % name)
+    return re.compile(pattern, re.S)
+
+
+def parseArguments(params):
+    """transform the matched template parameters into operation arguments"""
+    args = dict(params)
+    if 'uris' in args:
+        args['uris'] = re.findall('<([^<>]*)>', args['uris'])
+    for name in ('limit', 'offset'):
+        if name in args:
+            args[name] = int(args[name])
+    return args
+
+
+def localId(uri):
+    return uri[len(PREFIX):]
+
+
+def randomAcceptDatetime(hierarchies, rnd):
+    """return a random HTTP-date within the range of the hierarchies"""
+    days = (hierarchies.last_date - FIRST_DATE).days + 365
+    dt = datetime.datetime.combine(FIRST_DATE, datetime.time()) + \
+        datetime.timedelta(days=rnd.uniform(0, days))
+    return formatHTTPDate(dt)
+
+
+def buildRequests(hierarchies, routes, count, rnd):
+    """return a list of (route, path, headers) tuples"""
+    requests = []
+    for n in range(count):
+        route = routes[n % len(routes)]
+        headers = {}
+        if route == 'original':
+            path = '/memento/' + localId(rnd.choice(hierarchies.roots))
+        elif route == 'intermediate':
+            path = '/memento/%s?rel=intermediate' % localId(
+                rnd.choice(hierarchies.roots))
+            headers['Accept-Datetime'] = randomAcceptDatetime(hierarchies, rnd)
+        elif route == 'timegate':
+            path = '/memento/' + localId(rnd.choice(hierarchies.works))
+            headers['Accept-Datetime'] = randomAcceptDatetime(hierarchies, rnd)
+        elif route == 'timemap':
+            path = '/data/%s.txt' % localId(rnd.choice(
+                hierarchies.roots + hierarchies.works))
+        else:
+            path = '/data/%s.xml' % localId(rnd.choice(hierarchies.leaves))
+        requests.append((route, path, headers))
+    rnd.shuffle(requests)
+    return requests
+
+
+def percentile(values, p):
+    """return the p-th percentile (nearest rank) of sorted values"""
+    if not values:
+        return 0.0
+    return values[max(0, min(len(values) - 1,
+                             int(round(p / 100.0 * len(values))) - 1))]
+
+
+def appClient():
+    """return a function performing a request in-process"""
+    client = memento.app.test_client()
+
+    def get(path, headers):
+        response = client.get(path, headers=headers)
+        # consume streamed bodies (timemaps)
+        response.get_data()
+        return response.status_code
+    return get
+
+
+def httpClient(url):
+    """return a function performing a request against the service at url"""
+    session = Session()
+
+    def get(path, headers):
+        # the body is read completely (including streamed timemaps)
+        return session.get(url + path, headers=headers,
+                           allow_redirects=False).status_code
+    return get
+
+
+def waitForService(url, timeout):
+    """wait until the service at url answers"""
+    deadline = time.time() + timeout
+    while True:
+        try:
+            Session().get(url + '/metrics', timeout=1)
+            return
+        except RequestException:
+            if time.time() > deadline:
+                raise
+            time.sleep(0.5)
+
+
+def runRequests(requests, concurrency, cold=False, url=None, endpoint=None):
+    """perform the requests (in-process or against the service at url) and
+    return a list of (route, status, seconds, sparql queries) tuples together
+    with the elapsed wall time
+
+    the queries of a request are counted by the stub endpoint, which can
+    only attribute them while requests do not overlap (None otherwise)"""
+    clients = threading.local()
+    counting = endpoint is not None and concurrency == 1
+
+    def perform(request):
+        route, path, headers = request
+        if not hasattr(clients, 'get'):
+            clients.get = url and httpClient(url) or appClient()
+        if cold:
+            memento.invalidateLookups()
+            memento.representation_cache.invalidate()
+        queries = counting and endpoint.queries or 0
+        start = time.perf_counter()
+        status = clients.get(path, headers)
+        duration = time.perf_counter() - start
+        if counting:
+            queries = endpoint.queries - queries
+        else:
+            queries = None
+        return route, status, duration, queries
+
+    start = time.perf_counter()
+    with concurrent.futures.ThreadPoolExecutor(max_workers=concurrency) as \
+            executor:
+        results = list(executor.map(perform, requests))
+    return results, time.perf_counter() - start
+
+
+def summarize(results, elapsed, census=None):
+    """aggregate the results per route (and in total), the queries per
+    request are taken from the census results if given"""
+    report = {'routes': {}}
+    for route in ROUTES + ['total']:
+        selected = [r for r in results if route in (r[0], 'total')]
+        if not selected:
+            continue
+        durations = sorted([r[2] * 1000 for r in selected])
+        counted = [r[3] for r in census or results
+                   if route in (r[0], 'total') and r[3] is not None]
+        queries = None
+        if counted:
+            queries = float(sum(counted)) / len(counted)
+        report['routes'][route] = {
+            'requests': len(selected),
+            'errors': len([r for r in selected if r[1] >= 500]),
+            'p50_ms': percentile(durations, 50),
+            'p95_ms': percentile(durations, 95),
+            'p99_ms': percentile(durations, 99),
+            'queries_per_request': queries,
+        }
+    report['elapsed_s'] = elapsed
+    report['throughput_rps'] = len(results) / elapsed
+    return report
+
+
+def printReport(report, options):
+    print('%d hierarchies (depth %d, width %d), %s backend, latency %gms, '
+          'concurrency %d%s%s' % (
+              options.hierarchies, options.depth, options.width,
+              options.backend, options.latency, options.concurrency,
+              options.cold and ', cold caches' or '',
+              options.url and ', service at ' + options.url or ''))
+    print('%-13s %8s %7s %9s %9s %9s %12s' % (
+        'route', 'requests', 'errors', 'p50 ms', 'p95 ms', 'p99 ms',
+        'queries/req'))
+    for route, stats in report['routes'].items():
+        queries = stats['queries_per_request']
+        print('%-13s %8d %7d %9.2f %9.2f %9.2f %12s' % (
+            route, stats['requests'], stats['errors'], stats['p50_ms'],
+            stats['p95_ms'], stats['p99_ms'],
+            queries is None and '-' or '%.2f' % queries))
+    print('throughput: %.1f requests/s (%.2fs)' % (report['throughput_rps'],
+                                                   report['elapsed_s']))
+    if 'endpoint_queries' in report:
+        print('stub endpoint: %d queries' % report['endpoint_queries'])
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Memento service benchmark')
+    parser.add_argument('--hierarchies', type=int, default=100,
+                        help='number of synthetic hierarchies')
+    parser.add_argument('--depth', type=int, default=2,
+                        help='number of member levels below a root')
+    parser.add_argument('--width', type=int, default=4,
+                        help='number of members of every evolutive work')
+    parser.add_argument('--backend', choices=['stub', 'local'],
+                        default='stub',
+                        help='query the stub sparql endpoint over http '
+                             '(default) or the in-process local store')
+    parser.add_argument('--url',
+                        help='drive the service running at this url (e.g. '
+                             'a gunicorn deployment started against the '
+                             'stub endpoint) instead of the in-process app')
+    parser.add_argument('--stub-port', type=int, default=0,
+                        help='port of the stub sparql endpoint (default: '
+                             'any free port)')
+    parser.add_argument('--wait', type=float, default=120,
+                        help='seconds to wait for the service at --url')
+    parser.add_argument('--latency', type=float, default=2,
+                        help='latency of the stub endpoint (ms)')
+    parser.add_argument('--jitter', type=float, default=0,
+                        help='uniform jitter of the stub latency (ms)')
+    parser.add_argument('--requests', type=int, default=1000,
+                        help='number of measured requests')
+    parser.add_argument('--warmup', type=int, default=100,
+                        help='number of unmeasured requests sent first')
+    parser.add_argument('--concurrency', type=int, default=8,
+                        help='number of concurrent clients')
+    parser.add_argument('--routes', default=','.join(ROUTES),
+                        help='comma separated routes to drive (%s)' %
+                             ', '.join(ROUTES))
+    parser.add_argument('--census', type=int, default=200,
+                        help='number of requests sent one at a time after '
+                             'a concurrent run to count their queries')
+    parser.add_argument('--cold', action='store_true',
+                        help='clear the lookup and representation caches '
+                             'before every request')
+    parser.add_argument('--seed', type=int, default=0,
+                        help='seed of the request generator')
+    parser.add_argument('--json', action='store_true',
+                        help='print the report as json')
+    options = parser.parse_args()
+    routes = options.routes.split(',')
+    for route in routes:
+        if route not in ROUTES:
+            parser.error('unknown route: %s' % route)
+    if options.depth < 1 or options.width < 1:
+        parser.error('depth and width must be positive')
+    if 'timegate' in routes and options.depth < 2:
+        parser.error('the timegate route requires a depth of at least 2')
+    if options.url:
+        options.url = options.url.rstrip('/')
+        if options.backend != 'stub':
+            parser.error('--url requires the stub backend')
+        if options.cold:
+            parser.error('--cold requires the in-process service')
+
+    logging.basicConfig(level=logging.WARNING)
+    memento.CELLAR_PREFIX = PREFIX
+    hierarchies = Hierarchies(options.hierarchies, options.depth,
+                              options.width)
+    backend = localstore.LocalStoreBackend()
+    backend.store.add(hierarchies.triples)
+    endpoint = None
+    if options.backend == 'stub':
+        endpoint = StubEndpoint(backend, options.latency, options.jitter,
+                                options.stub_port)
+        endpoint.start()
+        memento.sparql_endpoint = endpoint.url
+        memento.sparql_backend = memento.createBackend()
+    else:
+        memento.sparql_backend = backend
+    if options.url:
+        print('waiting for the service at %s (start it with --endpoint %s '
+              '--prefix %s)' % (options.url, endpoint.url, PREFIX),
+              file=sys.stderr)
+        waitForService(options.url, options.wait)
+
+    rnd = random.Random(options.seed)
+    runRequests(buildRequests(hierarchies, routes, options.warmup, rnd),
+                options.concurrency, options.cold, options.url, endpoint)
+    queries = endpoint and endpoint.queries
+    results, elapsed = runRequests(
+        buildRequests(hierarchies, routes, options.requests, rnd),
+        options.concurrency, options.cold, options.url, endpoint)
+    census = None
+    if endpoint is not None:
+        endpoint_queries = endpoint.queries - queries
+        if options.concurrency > 1 and options.census > 0:
+            # overlapping requests share the endpoint, their queries are
+            # counted on requests sent one at a time
+            census, _ = runRequests(
+                buildRequests(hierarchies, routes, options.census, rnd), 1,
+                options.cold, options.url, endpoint)
+    report = summarize(results, elapsed, census)
+    if endpoint is not None:
+        report['endpoint_queries'] = endpoint_queries
+        endpoint.stop()
+    if options.json:
+        print(json.dumps(report, indent=2))
+    else:
+        printReport(report, options)
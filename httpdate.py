@@ -0,0 +1,108 @@
+# Authors: Sebastian Thelen, Patrick Gratz
+# Description: Fast conversion between the xsd:date/xsd:dateTime values
+# returned by the triple store and HTTP-dates (RFC 7231) used in Memento
+# headers. Values without timezone information are local (Luxembourg) times.
+
+import datetime
+import email.utils as eut
+import functools
+from zoneinfo import ZoneInfo
+
+# zone objects are created once
+UTC = datetime.timezone.utc
+LOCAL_TZ = ZoneInfo('Europe/Luxembourg')
+
+# number of memoized conversions
+CACHE_SIZE = 65536
+
+WEEKDAYS = ('Mon', 'Tue', 'Wed', 'Thu', 'Fri', 'Sat', 'Sun')
+MONTHS = ('Jan', 'Feb', 'Mar', 'Apr', 'May', 'Jun', 'Jul', 'Aug', 'Sep',
+          'Oct', 'Nov', 'Dec')
+MONTH_NUMBERS = dict((name, n + 1) for n, name in enumerate(MONTHS))
+
+
+@functools.lru_cache(maxsize=CACHE_SIZE)
+def parseXsdDatetime(text):
+    """parse a xsd:date or xsd:dateTime value
+
+    returns a tuple (naive datetime, timezone offset in minutes or None).
+    Supported formats are %Y-%m-%d and %Y-%m-%d %H:%M:%S (or with a 'T'
+    separator), optionally followed by fractional seconds and a 'Z' or
+    '+02:00' style offset"""
+    dt = datetime.datetime(int(text[0:4]), int(text[5:7]), int(text[8:10]))
+    if text[4:5] != '-' or text[7:8] != '-':
+        raise ValueError('invalid xsd date: %r' % text)
+    rest = text[10:]
+    if rest[:1] in ('T', ' '):
+        if rest[3:4] != ':' or rest[6:7] != ':':
+            raise ValueError('invalid xsd time: %r' % text)
+        dt = dt.replace(hour=int(rest[1:3]), minute=int(rest[4:6]),
+                        second=int(rest[7:9]))
+        rest = rest[9:]
+        # ignore fractional seconds
+        if rest[:1] == '.':
+            rest = rest.lstrip('.0123456789')
+    if not rest:
+        return dt, None
+    if rest == 'Z':
+        return dt, 0
+    if rest[0] in '+-' and len(rest) == 6 and rest[3] == ':':
+        offset = int(rest[1:3]) * 60 + int(rest[4:6])
+        return dt, rest[0] == '-' and -offset or offset
+    raise ValueError('invalid xsd timezone: %r' % text)
+
+
+def formatHTTPDate(utc_dt):
+    """format a UTC datetime as HTTP-date (independent of the locale)"""
+    return '%s, %02d %s %04d %02d:%02d:%02d GMT' % (
+        WEEKDAYS[utc_dt.weekday()], utc_dt.day, MONTHS[utc_dt.month - 1],
+        utc_dt.year, utc_dt.hour, utc_dt.minute, utc_dt.second)
+
+
+@functools.lru_cache(maxsize=CACHE_SIZE)
+def stringToHTTPDate(text):
+    """convert a xsd:date into an HTTP-date string"""
+    dt, offset = parseXsdDatetime(text)
+    if offset is None:
+        # localize datetime (set timezone to CET/CEST), ambiguous and
+        # non-existent local times resolve to standard time
+        local_dt = dt.replace(tzinfo=LOCAL_TZ, fold=1)
+        if local_dt.dst():
+            local_dt = local_dt.replace(fold=0)
+    else:
+        local_dt = dt.replace(
+            tzinfo=datetime.timezone(datetime.timedelta(minutes=offset)))
+    # transform localized datetime into UTC datetime
+    return formatHTTPDate(local_dt.astimezone(UTC))
+
+
+def stringsToHTTPDates(texts):
+    """convert a column of xsd:date values into HTTP-date strings"""
+    converted = {}
+    for text in texts:
+        if text not in converted:
+            converted[text] = stringToHTTPDate(text)
+    return [converted[text] for text in texts]
+
+
+@functools.lru_cache(maxsize=CACHE_SIZE)
+def parseHTTPDate(text):
+    """parse a HTTP-date and return a naive local datetime"""
+    # fast path for the preferred format: Sun, 06 Nov 1994 08:49:37 GMT
+    parts = text.split()
+    if len(parts) == 6 and parts[5] == 'GMT' and parts[2] in MONTH_NUMBERS:
+        hms = parts[4].split(':')
+        if len(hms) != 3:
+            raise ValueError('invalid HTTP-date: %r' % text)
+        utc_dt = datetime.datetime(int(parts[3]), MONTH_NUMBERS[parts[2]],
+                                   int(parts[1]), int(hms[0]), int(hms[1]),
+                                   int(hms[2]), tzinfo=UTC)
+    else:
+        # obsolete formats (RFC 850, asctime)
+        parsed = eut.parsedate(text)
+        if parsed is None:
+            raise ValueError('invalid HTTP-date: %r' % text)
+        utc_dt = datetime.datetime(*parsed[:6], tzinfo=UTC)
+    # transform UTC datetime into local time and return it without timezone
+    # information for further processing in virtuoso
+    return utc_dt.astimezone(LOCAL_TZ).replace(tzinfo=None)
@@ -0,0 +1,487 @@
+# Authors: Sebastian Thelen, Patrick Gratz
+# Description: In-process triple store answering the lookups of the Memento
+# service natively (without a SPARQL endpoint). The store is loaded from
+# N-Triples files or SPARQL INSERT dumps (e.g. consolidation_data.txt) and
+# keeps subject and predicate indexes in memory. It is read-only once loaded
+# and can therefore be shared by concurrent requests. LocalStoreBackend
+# answers the backend operations of the service (see memento.SparqlClient)
+# from a store.
+
+import collections
+import datetime
+import json
+import re
+from xml.sax.saxutils import escape, quoteattr
+from httpdate import parseXsdDatetime
+
+RDF = 'http://www.w3.org/1999/02/22-rdf-syntax-ns#'
+XSD = 'http://www.w3.org/2001/XMLSchema#'
+CDM = 'http://publications.europa.eu/ontology/cdm#'
+RDF_TYPE = RDF + 'type'
+EVOLUTIVE_WORK = CDM + 'evolutive_work'
+HAS_MEMBER = CDM + 'complex_work_has_member_work'
+DATETIME_NEGOTIATION = CDM + 'datetime_negotiation'
+DATE_CREATION = CDM + 'work_date_creation'
+
+# literal term (iris and blank nodes are plain strings, blank nodes start
+# with '_:')
+Literal = collections.namedtuple('Literal', 'value datatype lang')
+Literal.__new__.__defaults__ = (None, None)
+
+WHITESPACE = re.compile(r'(?:\s|#[^\n]*)*')
+TOKEN = re.compile(r'''
+    (?P<iri><[^<>"\s]*>)
+  | (?P<literal>"(?:[^"\\\n]|\\.)*")
+    (?:\^\^(?P<datatype><[^<>"\s]*>|(?:[A-Za-z][\w-]*)?:(?:[\w.-]*[\w-])?)
+      |@(?P<lang>[A-Za-z]+(?:-[A-Za-z0-9]+)*))?
+  | (?P<bnode>_:(?:[\w.-]*[\w-]))
+  | (?P<pname>(?:[A-Za-z][\w-]*)?:(?:[\w.-]*[\w-])?)
+  | (?P<number>[+-]?\d+(?:\.\d+)?)
+  | (?P<punctuation>[.;,{}])
+  | (?P<keyword>@?[A-Za-z]+)
+''', re.X)
+ESCAPE = re.compile(r'\\(?:u([0-9A-Fa-f]{4})|U([0-9A-Fa-f]{8})|(.))')
+ESCAPES = {'t': '\t', 'b': '\b', 'n': '\n', 'r': '\r', 'f': '\f'}
+# keywords of INSERT dumps which do not contribute triples
+DUMP_KEYWORDS = frozenset(['insert', 'delete', 'data', 'in', 'into', 'graph'])
+PREDEFINED_PREFIXES = {'rdf': RDF, 'xsd': XSD}
+
+
+def unescape(text):
+    """resolve the escape sequences of a literal"""
+    def replace(match):
+        code = match.group(1) or match.group(2)
+        if code:
+            return chr(int(code, 16))
+        return ESCAPES.get(match.group(3), match.group(3))
+    return ESCAPE.sub(replace, text)
+
+
+def parseTriples(text):
+    """parse N-Triples (or Turtle-like) statements and return the triples
+
+    PREFIX declarations and the INSERT/GRAPH wrapping of SPARQL update dumps
+    are accepted; ';' and ',' abbreviations are supported"""
+    prefixes = {}
+    triples = []
+    terms = []
+    pos = 0
+    # declaration waiting for further tokens: ('prefix',), ('prefix', name)
+    # or ('graph',)
+    pending = None
+    while True:
+        pos = WHITESPACE.match(text, pos).end()
+        if pos == len(text):
+            break
+        match = TOKEN.match(text, pos)
+        if match is None:
+            raise ValueError('invalid rdf syntax at offset %d: %r' % (
+                pos, text[pos:pos + 40]))
+        pos = match.end()
+        kind = match.lastgroup
+        if kind in ('datatype', 'lang'):
+            kind = 'literal'
+        token = match.group(kind)
+        if pending is not None:
+            if pending == ('prefix',) and kind == 'pname':
+                pending = ('prefix', token[:-1])
+            elif len(pending) == 2 and kind == 'iri':
+                prefixes[pending[1]] = token[1:-1]
+                pending = None
+            elif pending == ('graph',) and kind == 'iri':
+                pending = None
+            else:
+                raise ValueError('invalid declaration at offset %d' % pos)
+            continue
+        if kind == 'keyword':
+            keyword = token.lower()
+            if keyword in ('prefix', '@prefix'):
+                pending = ('prefix',)
+            elif keyword == 'graph':
+                pending = ('graph',)
+            elif keyword == 'a':
+                terms.append(RDF_TYPE)
+            elif keyword not in DUMP_KEYWORDS:
+                raise ValueError('unsupported keyword %r at offset %d' % (
+                    token, pos))
+        elif kind == 'punctuation':
+            if token == '{':
+                continue
+            if terms:
+                if len(terms) != 3:
+                    raise ValueError('incomplete triple at offset %d' % pos)
+                triples.append(tuple(terms))
+            terms = {';': terms[:1], ',': terms[:2]}.get(token, [])
+        elif kind == 'iri':
+            terms.append(token[1:-1])
+        elif kind == 'pname':
+            terms.append(expandName(token, prefixes))
+        elif kind == 'bnode':
+            terms.append(token)
+        elif kind == 'number':
+            terms.append(Literal(token, XSD + ('.' in token and 'decimal' or
+                                               'integer')))
+        else:
+            datatype = match.group('datatype')
+            if datatype is not None:
+                datatype = datatype.startswith('<') and datatype[1:-1] or \
+                    expandName(datatype, prefixes)
+            terms.append(Literal(unescape(token[1:-1]), datatype,
+                                 match.group('lang')))
+    if terms:
+        raise ValueError('incomplete triple at end of input')
+    return triples
+
+
+def expandName(name, prefixes):
+    """expand a prefixed name (the xsd and rdf prefixes are predefined)"""
+    prefix, local = name.split(':', 1)
+    namespace = prefixes.get(prefix, PREDEFINED_PREFIXES.get(prefix))
+    if namespace is None:
+        raise ValueError('undeclared prefix %r' % prefix)
+    return namespace + local
+
+
+def dateKey(literal):
+    """sort key of a xsd:date or xsd:dateTime literal (None if invalid)"""
+    try:
+        return parseXsdDatetime(literal.value)[0]
+    except (ValueError, AttributeError):
+        return None
+
+
+class LocalStore(object):
+    """in-memory triple store with subject and predicate indexes"""
+
+    def __init__(self):
+        # subject -> predicate -> objects and predicate -> object ->
+        # subjects (dicts are used as ordered sets)
+        self.spo = {}
+        self.pos = {}
+        self.size = 0
+
+    def load(self, path):
+        """load the triples of a N-Triples file or INSERT dump"""
+        with open(path, encoding='utf-8') as f:
+            return self.add(parseTriples(f.read()))
+
+    def add(self, triples):
+        """add triples to the store and return the number of new triples"""
+        added = 0
+        for s, p, o in triples:
+            objects = self.spo.setdefault(s, {}).setdefault(p, {})
+            if o in objects:
+                continue
+            objects[o] = None
+            self.pos.setdefault(p, {}).setdefault(o, {})[s] = None
+            added += 1
+        self.size += added
+        return added
+
+    def objects(self, s, p):
+        return list(self.spo.get(s, {}).get(p, ()))
+
+    def subjects(self, p, o):
+        return list(self.pos.get(p, {}).get(o, ()))
+
+    def describe(self, uri):
+        """return the triples having the given uri as subject"""
+        return [(uri, p, o) for p, objects in self.spo.get(uri, {}).items()
+                for o in objects]
+
+    def isEvolutiveWork(self, uri):
+        return EVOLUTIVE_WORK in self.spo.get(uri, {}).get(RDF_TYPE, ())
+
+    def evolutiveWorks(self):
+        return sorted(self.subjects(RDF_TYPE, EVOLUTIVE_WORK))
+
+    def members(self, uri):
+        return self.objects(uri, HAS_MEMBER)
+
+    def predecessors(self, uri):
+        return self.subjects(HAS_MEMBER, uri)
+
+    def roots(self, uri):
+        """return the topmost works of the hierarchies containing uri"""
+        roots = []
+        seen = set([uri])
+        stack = [uri]
+        while stack:
+            work = stack.pop()
+            predecessors = self.predecessors(work)
+            if not predecessors and work in self.spo:
+                roots.append(work)
+            for predecessor in predecessors:
+                if predecessor not in seen:
+                    seen.add(predecessor)
+                    stack.append(predecessor)
+        return roots
+
+    def ancestors(self, uri):
+        """return uri and all works above it"""
+        seen = collections.OrderedDict([(uri, None)])
+        stack = [uri]
+        while stack:
+            for predecessor in self.predecessors(stack.pop()):
+                if predecessor not in seen:
+                    seen[predecessor] = None
+                    stack.append(predecessor)
+        return list(seen)
+
+    def descendants(self, uri):
+        """return uri and all works below it"""
+        seen = collections.OrderedDict([(uri, None)])
+        stack = [uri]
+        while stack:
+            for member in self.members(stack.pop()):
+                if member not in seen:
+                    seen[member] = None
+                    stack.append(member)
+        return list(seen)
+
+    def negotiationDates(self, uri):
+        """return the distinct (successor, date) pairs used for datetime
+        negotiation in the given work"""
+        properties = self.objects(uri, DATETIME_NEGOTIATION)
+        pairs = collections.OrderedDict()
+        for successor in self.members(uri):
+            for work in [successor] + self.members(successor):
+                for prop in properties:
+                    for date in self.objects(work, prop):
+                        pairs[(successor, date)] = None
+        return list(pairs)
+
+    def mementoDatetimes(self, uri):
+        """return the dates of uri in the dimension of its timegates"""
+        dates = []
+        for timegate in self.predecessors(uri):
+            for prop in self.objects(timegate, DATETIME_NEGOTIATION):
+                dates.extend(self.objects(uri, prop))
+        return dates
+
+
+def termKey(term):
+    """sort key of a term (literals are compared by their lexical value)"""
+    return isinstance(term, Literal) and term.value or term
+
+
+def toRows(rows):
+    """transform rows of terms into rows of values (the lexical values of
+    literals), unbound variables are left out"""
+    return [dict([(name, termKey(term)) for name, term in row.items()
+                  if term is not None]) for row in rows]
+
+
+def toNTriples(triples):
+    """serialize triples as N-Triples (which is valid turtle)"""
+    def term(t):
+        if isinstance(t, Literal):
+            value = '"%s"' % t.value.replace('\\', '\\\\').replace(
+                '"', '\\"').replace('\n', '\\n').replace('\r', '\\r')
+            if t.lang:
+                return '%s@%s' % (value, t.lang)
+            return t.datatype and '%s^^<%s>' % (value, t.datatype) or value
+        return t.startswith('_:') and t or '<%s>' % t
+    return ''.join(['%s %s %s .\n' % (term(s), term(p), term(o))
+                    for s, p, o in triples])
+
+
+def toJsonLd(triples):
+    """serialize triples as expanded JSON-LD"""
+    nodes = collections.OrderedDict()
+    for s, p, o in triples:
+        if isinstance(o, Literal):
+            value = {'@value': o.value}
+            if o.datatype:
+                value['@type'] = o.datatype
+            if o.lang:
+                value['@language'] = o.lang
+        elif p == RDF_TYPE:
+            nodes.setdefault(s, {'@id': s}).setdefault('@type', []).append(o)
+            continue
+        else:
+            value = {'@id': o}
+        nodes.setdefault(s, {'@id': s}).setdefault(p, []).append(value)
+    return json.dumps(list(nodes.values()), indent=2)
+
+
+def toRdfXml(triples):
+    """serialize triples as RDF/XML"""
+    lines = ['<?xml version="1.0" encoding="utf-8" ?>',
+             '<rdf:RDF xmlns:rdf="%s">' % RDF]
+    subject = None
+    for s, p, o in triples:
+        if s != subject:
+            if subject is not None:
+                lines.append('  </rdf:Description>')
+            lines.append('  <rdf:Description %s=%s>' % (
+                s.startswith('_:') and 'rdf:nodeID' or 'rdf:about',
+                quoteattr(s.startswith('_:') and s[2:] or s)))
+            subject = s
+        split = max(p.rfind('#'), p.rfind('/')) + 1
+        element = 'ns0:%s xmlns:ns0=%s' % (p[split:], quoteattr(p[:split]))
+        if isinstance(o, Literal):
+            attributes = o.datatype and ' rdf:datatype=%s' % quoteattr(
+                o.datatype) or o.lang and ' xml:lang=%s' % quoteattr(
+                o.lang) or ''
+            lines.append('    <%s%s>%s</ns0:%s>' % (
+                element, attributes, escape(o.value), p[split:]))
+        else:
+            lines.append('    <%s %s=%s />' % (
+                element, o.startswith('_:') and 'rdf:nodeID' or
+                'rdf:resource', quoteattr(o.startswith('_:') and o[2:] or o)))
+    if subject is not None:
+        lines.append('  </rdf:Description>')
+    lines.append('</rdf:RDF>')
+    return '\n'.join(lines) + '\n'
+
+
+# serializers by format parameter of the sparql endpoint
+SERIALIZERS = {
+    'text/turtle': toNTriples,
+    'text/plain': toNTriples,
+    'application/ld+json': toJsonLd,
+    'application/rdf+xml': toRdfXml,
+}
+
+
+class LocalStoreBackend(object):
+    """in-process backend answering the operations of the service natively
+
+    the operations are answered with indexed lookups in a LocalStore, no
+    sparql engine (nor Virtuoso functions like bif:datediff) is involved.
+    Like the operations of memento.SparqlClient they return the rows of the
+    result (variable names mapped to values)"""
+
+    def __init__(self, paths=()):
+        self.store = LocalStore()
+        for path in paths:
+            self.store.load(path)
+
+    def close(self):
+        pass
+
+    def uriR(self, uri):
+        return [{'predecessor': root} for root in self.store.roots(uri)]
+
+    def urisR(self, uris):
+        return [{'uri': uri, 'predecessor': root}
+                for uri in uris for root in self.store.roots(uri)]
+
+    def datetimeProperty(self, uri):
+        return [{'prop': prop} for prop in self.store.objects(
+            uri, DATETIME_NEGOTIATION)]
+
+    def location(self, uri, accept_datetime):
+        # accept_datetime is a (naive) datetime or a xsd:dateTime value
+        if isinstance(accept_datetime, datetime.datetime):
+            accept_datetime = accept_datetime.replace(tzinfo=None)
+        else:
+            accept_datetime = parseXsdDatetime(str(accept_datetime))[0]
+        location = None
+        for successor, date in self.store.negotiationDates(uri):
+            dt = dateKey(date)
+            if dt is not None and dt <= accept_datetime and \
+                    (location is None or dt > location[0]):
+                location = (dt, successor)
+        return location and [{'successor': location[1]}] or []
+
+    def describe(self, uri, format):
+        if format not in SERIALIZERS:
+            raise ValueError('unsupported result format: %s' % format)
+        return SERIALIZERS[format](self.store.describe(uri))
+
+    def evolutiveWork(self, uri):
+        if not self.store.isEvolutiveWork(uri):
+            return []
+        return [{'p': p} for s, p, o in self.store.describe(uri)]
+
+    def mementoDatetime(self, uri):
+        return toRows([{'date': date}
+                       for date in self.store.mementoDatetimes(uri)])
+
+    def mementoDatetimes(self, uris):
+        return toRows([{'uri': uri, 'date': date} for uri in uris
+                       for date in self.store.mementoDatetimes(uri)])
+
+    def relatedEvolutiveWorks(self, uri):
+        works = collections.OrderedDict.fromkeys(
+            self.store.members(uri) + self.store.predecessors(uri))
+        return [{'evolutive_work': work} for work in works
+                if self.store.isEvolutiveWork(work)]
+
+    def relatedMementos(self, uri, limit, offset):
+        mementos = [(memento, date) for memento in self.store.members(uri)
+                    if not self.store.members(memento)
+                    for date in self.store.objects(memento, DATE_CREATION)]
+        mementos.sort(key=lambda pair: (termKey(pair[1]), pair[0]))
+        return toRows([{'memento': memento, 'date': date}
+                       for memento, date in mementos[offset:offset + limit]])
+
+    def timemapInfo(self, uris):
+        rows = []
+        for work in uris:
+            for prop in self.store.objects(work, DATETIME_NEGOTIATION):
+                dates = [date for member in self.store.members(work)
+                         for date in self.store.objects(member, prop)]
+                if dates:
+                    rows.append({'work': work,
+                                 'startdate': min(dates, key=termKey),
+                                 'enddate': max(dates, key=termKey),
+                                 'typeofdate': prop})
+        return toRows(rows)
+
+    def negotiationRows(self, work):
+        dates = self.store.negotiationDates(work)
+        if not dates:
+            return [{'work': work}]
+        return [{'work': work, 'successor': successor, 'date': date}
+                for successor, date in dates]
+
+    def temporalIndex(self, limit, offset):
+        rows = []
+        for work in self.store.evolutiveWorks():
+            rows.extend(sorted(self.negotiationRows(work), key=lambda row: (
+                row.get('successor', ''), termKey(row.get('date', '')))))
+        return toRows(rows[offset:offset + limit])
+
+    def cascade(self, uris):
+        works = collections.OrderedDict()
+        for root in uris:
+            for work in self.store.descendants(root):
+                works[work] = None
+        rows = []
+        for work in works:
+            if self.store.isEvolutiveWork(work):
+                rows.extend(self.negotiationRows(work))
+        return toRows(rows)
+
+    def timemapFingerprints(self, limit, offset):
+        rows = []
+        for work in self.store.evolutiveWorks():
+            members = self.store.members(work)
+            if not members:
+                continue
+            dates = [termKey(date) for member in members
+                     for date in self.store.objects(member, DATE_CREATION)]
+            rows.append({'work': work, 'members': str(len(members)),
+                         'lastdate': dates and max(dates) or None})
+        return toRows(rows[offset:offset + limit])
+
+    def predecessors(self, uri):
+        return [{'predecessor': predecessor}
+                for predecessor in self.store.predecessors(uri)]
+
+    def ancestors(self, uris):
+        ancestors = collections.OrderedDict()
+        for uri in uris:
+            for ancestor in self.store.ancestors(uri):
+                ancestors[ancestor] = None
+        return [{'ancestor': ancestor} for ancestor in ancestors]
+
+    def members(self, uris):
+        members = collections.OrderedDict()
+        for uri in uris:
+            for member in self.store.members(uri):
+                members[member] = None
+        return [{'member': member} for member in members]
@@ -1,25 +1,68 @@
 # Authors: Sebastian Thelen, Patrick Gratz
 # Description: The following code represents a prototypical implementation of the Memento framework (RFC 7089). For further information concerning Memento we refer to http://www.mementoweb.org/.
-# Prerequisites: Python 3.x, Flask microframework for Python
+# Prerequisites: Python 3.9+, Flask microframework for Python
 # (http://flask.pocoo.org/), Virtuoso 7 or a triple store with an
-# equivalent SPARQL endpoint
+# equivalent SPARQL endpoint (alternatively N-Triples or INSERT dumps served
+# from the in-process store, see localstore.py)
+
+if __name__ == '__main__':
+    import argparse
+    # the app is preloaded in the gunicorn master process (see runServer),
+    # gevent workers need the standard library patched before requests,
+    # urllib3 and ssl are imported
+    serving_parser = argparse.ArgumentParser(add_help=False)
+    serving_parser.add_argument('--workers', type=int, default=0)
+    serving_parser.add_argument('--worker-class', default='gevent')
+    serving_args = serving_parser.parse_known_args()[0]
+    if serving_args.workers > 0 and serving_args.worker_class == 'gevent':
+        from gevent import monkey
+        monkey.patch_all()
 
 from flask import Flask
 from flask import request
 from flask import redirect
 from flask import make_response
-from pytz import timezone
+from flask import stream_with_context
+from flask import send_file
+from flask import g
 import time
 import requests
+import requests.adapters
+from urllib3.util.retry import Retry
 import json
 import logging
 import logging.handlers
-import email.utils as eut
 import datetime
-import pytz
+import threading
+import functools
+import collections
+import bisect
+import concurrent.futures
+import os
+import urllib.parse
+import argparse
+import contextvars
+import hashlib
+import hmac
+import queue
+import atexit
+import email.utils as eut
+import gzip
+import re
+try:
+    import brotli
+except ImportError:
+    # responses are only gzip-compressed
+    brotli = None
+from httpdate import parseHTTPDate, parseXsdDatetime, stringToHTTPDate, \
+    stringsToHTTPDates
+import localstore
 
 CELLAR_PREFIX = "http://cellar1-dev.publications.europa.eu/resource/celex/"
 
+# root logger (configured by the command line, see below)
+LOGGER = logging.getLogger()
+
 # suppress logging messages from requests lib
 requests_log = logging.getLogger("requests")
 requests_log.setLevel(logging.ERROR)
@@ -27,6 +70,91 @@ requests_log.setLevel(logging.ERROR)
 # global variable stores address of host and sparql-endpoint
 local_host = 'http://localhost:5000'
 sparql_endpoint = 'http://abel:8890/sparql'
+# N-Triples files or INSERT dumps loaded into an in-process store which
+# answers all queries instead of the sparql endpoint (empty list uses the
+# endpoint)
+local_store_files = []
+# connection pool size, timeout (seconds) and retry policy of the sparql client
+# (the pool holds at least sparql_max_concurrency connections, one for every
+# query in flight)
+sparql_pool_size = 32
+sparql_timeout = 30
+sparql_retries = 3
+sparql_backoff = 0.2
+# maximum number of concurrent backend queries (per process) and maximum
+# time (seconds) a query waits for a free slot
+sparql_max_concurrency = 32
+sparql_queue_timeout = 2
+# circuit breaker: opens if at least sparql_breaker_ratio of the queries of
+# the last sparql_breaker_window seconds failed (given at least
+# sparql_breaker_min_queries queries), probes the backend again after
+# sparql_breaker_reset seconds
+sparql_breaker_ratio = 0.5
+sparql_breaker_min_queries = 20
+sparql_breaker_window = 30
+sparql_breaker_reset = 15
+# maximum time (seconds past expiry) cached lookups and timemaps are served
+# while the backend is unavailable, number of timemaps kept as fallback,
+# maximum size (bytes) of a kept timemap and number of negotiation results
+# kept as fallback
+stale_max_age = 86400
+timemap_cache_size = 100
+timemap_cache_max_size = 1048576
+negotiation_cache_size = 10000
+# number of sparql queries executed concurrently when fanning out
+sparql_fanout_workers = 8
+# maximum number of uris bound in the VALUES block of a batched query
+sparql_values_batch_size = 100
+# number of rows fetched per query when paging through large result sets
+sparql_page_size = 10000
+# number of mementos per timemap page (0 disables paging) and number of
+# mementos fetched per query while streaming an unpaged timemap
+timemap_page_size = 0
+timemap_chunk_size = 1000
+# directory of materialized timemaps (None serves all timemaps live) and
+# number of timemaps rebuilt concurrently during a refresh
+timemap_store_dir = None
+timemap_store_workers = 4
+# lifetime (seconds) of responses in shared caches: mementos are immutable,
+# negotiation results and timemaps change when new versions are ingested
+memento_max_age = 31536000
+timegate_max_age = 60
+timemap_max_age = 300
+# minimum size (bytes) of compressed data representations and number of
+# (immutable) representations kept in memory
+compression_min_size = 1024
+representation_cache_size = 1000
+# maximum number of items of a batch resolution request, number of items
+# resolved together (grouped queries) and number of groups resolved
+# concurrently
+batch_max_items = 10000
+batch_chunk_size = 100
+batch_workers = 4
+# size and time to live (seconds) of the cache for structural lookups
+lookup_cache_size = 10000
+lookup_cache_ttl = 3600
+# number of celex ids warmed up concurrently by the warm-up job and number
+# of most requested ids taken from an access log
+warmup_workers = 8
+warmup_top = 1000
+# level of the log records (debug records are expensive on the hot path)
+log_level = 'INFO'
+# optional in-memory temporal index used for datetime negotiation and the
+# interval (seconds) in which it is reloaded; new members are negotiated
+# once the index has been reloaded (or right away if the modified works
+# are invalidated, see invalidation_poll_interval). 0 disables reloading,
+# the index must then be paired with invalidation
+temporal_index_enabled = False
+temporal_index_refresh = 300
+# interval (seconds) in which the timemap fingerprints are polled for
+# modified works whose cached lookups and timemaps are evicted (0 disables
+# polling); invalidations pushed to the webhook must carry the shared
+# secret token as bearer token (None disables the webhook) and come from
+# one of the allowed hosts (all clients of a local reverse proxy connect
+# from 127.0.0.1, the token is what protects the webhook)
+invalidation_poll_interval = 0
+invalidation_token = os.environ.get('MEMENTO_INVALIDATION_TOKEN')
+invalidation_webhook_hosts = ('127.0.0.1', '::1')
 app = Flask(__name__)
 
 # compute original resource (URI-R) in a hierarchy
@@ -93,22 +221,102 @@ RELATED_EVOLUTIVE_WORKS = (
     '<%(uri)s> cdm:complex_work_has_member_work|^cdm:complex_work_has_member_work ?evolutive_work.'
     '?evolutive_work a cdm:evolutive_work. }'
 )
-# return related mementos together with their memento-datetime
+# return a page of related mementos together with their memento-datetime
 RELATED_MEMENTOS = (
     'prefix cdm: <http://publications.europa.eu/ontology/cdm#> '
     'select distinct ?memento ?date where {'
     '<%(uri)s> cdm:complex_work_has_member_work ?memento.'
     '?memento cdm:work_date_creation ?date.'
-    'filter not exists { ?memento cdm:complex_work_has_member_work ?member.} }'
+    'filter not exists { ?memento cdm:complex_work_has_member_work ?member.} } '
+    'order by ?date ?memento limit %(limit)s offset %(offset)s'
 )
 
 # return timemap related information (startdate, enddate and type of date)
+# for a set of evolutive works
 TIMEMAPINFO = (
     'prefix cdm: <http://publications.europa.eu/ontology/cdm#> '
-    'select (min(?o) as ?startdate) (max(?o) as ?enddate) (?p as ?typeofdate) where {'
-    '<%(uri)s> cdm:datetime_negotiation ?p;  '
+    'select ?work (min(?o) as ?startdate) (max(?o) as ?enddate) (?p as ?typeofdate) where {'
+    'values ?work { %(uris)s } '
+    '?work cdm:datetime_negotiation ?p;  '
     'cdm:complex_work_has_member_work ?member. '
-    '?member ?p ?o.}'
+    '?member ?p ?o.} '
+    'group by ?work ?p'
+)
+
+# return the members of all evolutive works together with the dates used
+# for datetime negotiation (bulk load of the temporal index)
+TEMPORAL_INDEX_TEMPLATE = (
+    'PREFIX cdm: <http://publications.europa.eu/ontology/cdm#> '
+    'select distinct ?work ?successor ?date where { '
+    '?work a cdm:evolutive_work. '
+    'optional { '
+    '?work cdm:datetime_negotiation ?datetime_property; '
+    'cdm:complex_work_has_member_work ?successor. '
+    '?successor cdm:complex_work_has_member_work? ?individual_work. '
+    '?individual_work ?datetime_property ?date. } } '
+    'order by ?work ?successor ?date '
+    'limit %(limit)s offset %(offset)s'
+)
+
+# return the members and negotiation dates of all evolutive works in the
+# hierarchies below the given uris (cascade resolution in one round-trip)
+CASCADE_TEMPLATE = (
+    'PREFIX cdm: <http://publications.europa.eu/ontology/cdm#> '
+    'select distinct ?work ?successor ?date where { '
+    'values ?root { %(uris)s } '
+    '?root cdm:complex_work_has_member_work* ?work. '
+    '?work a cdm:evolutive_work. '
+    'optional { '
+    '?work cdm:datetime_negotiation ?datetime_property; '
+    'cdm:complex_work_has_member_work ?successor. '
+    '?successor cdm:complex_work_has_member_work? ?individual_work. '
+    '?individual_work ?datetime_property ?date. } }'
+)
+
+# return a fingerprint (number of members and latest creation date of a
+# member) of every evolutive work, used to detect modified timemaps
+TIMEMAP_FINGERPRINT_TEMPLATE = (
+    'prefix cdm: <http://publications.europa.eu/ontology/cdm#> '
+    'select ?work (count(distinct ?member) as ?members) (max(str(?date)) as ?lastdate) where { '
+    '?work a cdm:evolutive_work; '
+    'cdm:complex_work_has_member_work ?member. '
+    'optional { ?member cdm:work_date_creation ?date. } } '
+    'group by ?work '
+    'order by ?work '
+    'limit %(limit)s offset %(offset)s'
+)
+
+# rdf serializations of data representations (most compact first) together
+# with the corresponding format parameter of the sparql endpoint
+DATA_FORMATS = collections.OrderedDict([
+    ('text/turtle', 'text/turtle'),
+    ('application/n-triples', 'text/plain'),
+    ('application/ld+json', 'application/ld+json'),
+    ('application/rdf+xml', 'application/rdf+xml'),
+])
+
+# characters which must not occur in a celex id (they would end the <...>
+# iris of the queries or are not allowed in iris at all)
+INVALID_ID_CHARACTERS = re.compile(r'[<>"{}|^`\\\x00-\x20]')
+
+# compute original resources (URI-R) of a set of uris
+URI_R_BATCH_TEMPLATE = (
+    'PREFIX cdm: <http://publications.europa.eu/ontology/cdm#> '
+    'select distinct ?uri ?predecessor where { '
+    'values ?uri { %(uris)s } '
+    '?predecessor cdm:complex_work_has_member_work* ?uri. '
+    '?predecessor ?p ?o. '
+    'filter not exists{?anotherWork cdm:complex_work_has_member_work ?predecessor.}} '
+)
+
+# return memento datetimes of a set of mementos
+MEMENTO_DATETIME_BATCH_TEMPLATE = (
+    'PREFIX cdm: <http://publications.europa.eu/ontology/cdm#> '
+    'select ?uri ?date where { '
+    'values ?uri { %(uris)s } '
+    '?uri ?p ?date; '
+    '^cdm:complex_work_has_member_work ?tg. '
+    '?tg cdm:datetime_negotiation ?p.}'
 )
 
 COMPLEX_WORK_PREDECESSOR_TEMPLATE = (
@@ -117,31 +325,697 @@ COMPLEX_WORK_PREDECESSOR_TEMPLATE = (
     '<%(uri)s> ^cdm:complex_work_has_member_work ?predecessor.} '
 )
 
+# compute a set of works together with all works above them (the hierarchy
+# traversed by URI_R_TEMPLATE)
+ANCESTORS_TEMPLATE = (
+    'PREFIX cdm: <http://publications.europa.eu/ontology/cdm#> '
+    'select distinct ?ancestor where { '
+    'values ?uri { %(uris)s } '
+    '?ancestor cdm:complex_work_has_member_work* ?uri.} '
+)
 
-def sparqlQuery(query, format="application/json"):
-    """perform sparql query and return the corresponding bindings"""
-    payload = {
-        "default-graph-uri": "",
-        "query": query,
-        "debug": "on",
-        "timeout": "",
-        "format": format
-    }
-    resp = requests.get(sparql_endpoint, params=payload)
-    if format == "application/json":
-        json_results = json.loads(resp.text)
-        return json_results['results']['bindings']
-    return resp.text
+# compute the members of a set of works
+MEMBERS_TEMPLATE = (
+    'PREFIX cdm: <http://publications.europa.eu/ontology/cdm#> '
+    'select distinct ?member where { '
+    'values ?work { %(uris)s } '
+    '?work cdm:complex_work_has_member_work ?member.} '
+)
+
+
+class SparqlClient(object):
+    """sparql endpoint client reusing keep-alive connections from a pool
+
+    the backend operations of the service are answered by queries built from
+    the templates above and return the rows of the result (variable names
+    mapped to values), see localstore.LocalStoreBackend for the in-process
+    backend"""
+
+    def __init__(self, endpoint, pool_size=10, timeout=30, retries=3,
+                 backoff=0.2, debug=False):
+        self.endpoint = endpoint
+        self.timeout = timeout
+        self.debug = debug
+        # retry transient server errors (and failed connects) with
+        # exponential backoff
+        retry = Retry(total=retries, read=0, backoff_factor=backoff,
+                      status_forcelist=(500, 502, 503, 504),
+                      allowed_methods=frozenset(['GET']),
+                      raise_on_status=False)
+        adapter = requests.adapters.HTTPAdapter(
+            pool_connections=1, pool_maxsize=pool_size, max_retries=retry)
+        self.session = requests.Session()
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+
+    def query(self, query, format="application/json", timeout=None):
+        """perform sparql query and return the corresponding bindings"""
+        payload = {
+            "default-graph-uri": "",
+            "query": query,
+            "debug": self.debug and "on" or "",
+            "timeout": "",
+            "format": format
+        }
+        resp = self.session.get(self.endpoint, params=payload,
+                                timeout=timeout or self.timeout)
+        resp.raise_for_status()
+        if format == "application/json":
+            json_results = json.loads(resp.text)
+            return json_results['results']['bindings']
+        return resp.text
+
+    def select(self, template, **params):
+        """perform the select query built from template and params and
+        return its rows"""
+        return [dict([(name, binding['value'])
+                      for name, binding in row.items()])
+                for row in self.query(template % params)]
+
+    def close(self):
+        """release all pooled connections"""
+        self.session.close()
+
+    def uriR(self, uri):
+        return self.select(URI_R_TEMPLATE, uri=uri)
+
+    def urisR(self, uris):
+        return self.select(URI_R_BATCH_TEMPLATE, uris=toValues(uris))
+
+    def datetimeProperty(self, uri):
+        return self.select(DATETIME_PROPERTY_TEMPLATE, uri=uri)
+
+    def location(self, uri, accept_datetime):
+        return self.select(LOCATION_TEMPLATE, uri=uri,
+                           accept_datetime=accept_datetime)
+
+    def describe(self, uri, format):
+        return self.query(DESCRIBE_TEMPLATE % {'uri': uri}, format)
+
+    def evolutiveWork(self, uri):
+        return self.select(EVOLUTIVE_WORK_TEMPLATE, uri=uri)
+
+    def mementoDatetime(self, uri):
+        return self.select(MEMENTO_DATETIME_TEMPLATE, uri=uri)
+
+    def mementoDatetimes(self, uris):
+        return self.select(MEMENTO_DATETIME_BATCH_TEMPLATE,
+                           uris=toValues(uris))
+
+    def relatedEvolutiveWorks(self, uri):
+        return self.select(RELATED_EVOLUTIVE_WORKS, uri=uri)
+
+    def relatedMementos(self, uri, limit, offset):
+        return self.select(RELATED_MEMENTOS, uri=uri, limit=limit,
+                           offset=offset)
+
+    def timemapInfo(self, uris):
+        return self.select(TIMEMAPINFO, uris=toValues(uris))
+
+    def temporalIndex(self, limit, offset):
+        return self.select(TEMPORAL_INDEX_TEMPLATE, limit=limit,
+                           offset=offset)
+
+    def cascade(self, uris):
+        return self.select(CASCADE_TEMPLATE, uris=toValues(uris))
+
+    def timemapFingerprints(self, limit, offset):
+        return self.select(TIMEMAP_FINGERPRINT_TEMPLATE, limit=limit,
+                           offset=offset)
+
+    def predecessors(self, uri):
+        return self.select(COMPLEX_WORK_PREDECESSOR_TEMPLATE, uri=uri)
+
+    def ancestors(self, uris):
+        return self.select(ANCESTORS_TEMPLATE, uris=toValues(uris))
+
+    def members(self, uris):
+        return self.select(MEMBERS_TEMPLATE, uris=toValues(uris))
+
+
+def createBackend():
+    """create the backend answering the queries of the service (the local
+    store if files are configured, the sparql endpoint otherwise)"""
+    if local_store_files:
+        return localstore.LocalStoreBackend(local_store_files)
+    return SparqlClient(sparql_endpoint,
+                        pool_size=max(sparql_pool_size, sparql_max_concurrency),
+                        timeout=sparql_timeout, retries=sparql_retries,
+                        backoff=sparql_backoff)
+
+
+sparql_backend = createBackend()
+
+
+class SparqlUnavailable(Exception):
+    """the backend cannot answer queries (failure, overload or open circuit
+    breaker)"""
+
+
+class SparqlQueryError(Exception):
+    """the backend rejected a query (client error of the endpoint), the
+    backend itself is healthy"""
+
+
+class CircuitBreaker(object):
+    """circuit breaker tripping on the failure rate of backend queries
+
+    while the breaker is open queries fail immediately; after reset
+    seconds a single probe query is let through (half-open) whose outcome
+    closes or reopens the breaker"""
+
+    def __init__(self, ratio=0.5, min_queries=20, window=30, reset=15):
+        self.ratio = ratio
+        self.min_queries = min_queries
+        self.window = window
+        self.reset = reset
+        self.opened = None
+        self._probing = False
+        self._outcomes = collections.deque()
+        self._failures = 0
+        self._lock = threading.Lock()
+
+    def isOpen(self):
+        return self.opened is not None
+
+    def before(self):
+        """admit a query, returns True if the query is the probe of a
+        half-open breaker (raises SparqlUnavailable if the breaker is open)"""
+        with self._lock:
+            if self.opened is None:
+                return False
+            if not self._probing and time.time() - self.opened >= self.reset:
+                self._probing = True
+                return True
+        raise SparqlUnavailable('circuit breaker is open')
+
+    def after(self, probe, failed):
+        """record the outcome of an admitted query (failed is None if the
+        query has not been executed)"""
+        with self._lock:
+            now = time.time()
+            if probe:
+                self._probing = False
+                if failed is not None:
+                    self.opened = failed and now or None
+                    self._outcomes.clear()
+                    self._failures = 0
+                    LOGGER.warning('Circuit breaker %s' % (
+                        failed and 'reopened' or 'closed'))
+                return
+            if failed is None or self.opened is not None:
+                return
+            self._outcomes.append((now, failed))
+            self._failures += failed and 1 or 0
+            while self._outcomes[0][0] < now - self.window:
+                self._failures -= self._outcomes.popleft()[1] and 1 or 0
+            if len(self._outcomes) >= self.min_queries and \
+                    self._failures >= self.ratio * len(self._outcomes):
+                self.opened = now
+                LOGGER.warning('Circuit breaker opened: %d of %d queries '
+                               'failed' % (self._failures,
+                                           len(self._outcomes)))
+
+    def retryAfter(self):
+        """seconds until the backend is probed again"""
+        opened = self.opened
+        if opened is None:
+            return 1
+        return max(1, int(self.reset - (time.time() - opened)) + 1)
+
+
+def createProtection():
+    """create the concurrency limiter and circuit breaker of the backend"""
+    return threading.BoundedSemaphore(sparql_max_concurrency), \
+        CircuitBreaker(sparql_breaker_ratio, sparql_breaker_min_queries,
+                       sparql_breaker_window, sparql_breaker_reset)
+
+
+sparql_limiter, circuit_breaker = createProtection()
+
+
+def formatMetric(name, description, type, samples):
+    """render samples (suffix, labels, value) in prometheus text format
+
+    every sample is labelled with the pid of this process, the worker
+    processes of the production server keep separate metrics"""
+    lines = ['# HELP %s %s' % (name, description),
+             '# TYPE %s %s' % (name, type)]
+    pid = [('pid', os.getpid())]
+    for suffix, labels, value in samples:
+        labels = pid + list(labels)
+        lines.append('%s%s%s %s' % (name, suffix, labels and '{%s}' % ','.join(
+            ['%s="%s"' % (key, str(label).replace('\\', '\\\\').replace(
+                '"', '\\"').replace('\n', '\\n'))
+             for key, label in labels]) or '', repr(float(value))))
+    return '\n'.join(lines) + '\n'
+
+
+class Metric(object):
+    """labelled counter or (with buckets) histogram of this process"""
+
+    def __init__(self, name, description, labels, buckets=None):
+        self.name = name
+        self.description = description
+        self.labels = labels
+        self.buckets = buckets
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, labels, amount=1):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    def observe(self, labels, value):
+        with self._lock:
+            entry = self._values.get(labels)
+            if entry is None:
+                entry = self._values[labels] = [
+                    [0] * len(self.buckets), 0.0, 0]
+            i = bisect.bisect_left(self.buckets, value)
+            if i < len(self.buckets):
+                entry[0][i] += 1
+            entry[1] += value
+            entry[2] += 1
+
+    def render(self):
+        with self._lock:
+            values = sorted([(labels, self.buckets and
+                              (list(value[0]), value[1], value[2]) or value)
+                             for labels, value in self._values.items()])
+        samples = []
+        for labels, value in values:
+            labels = list(zip(self.labels, labels))
+            if not self.buckets:
+                samples.append(('', labels, value))
+                continue
+            counts, total, count = value
+            cumulative = 0
+            for bound, n in zip(self.buckets, counts):
+                cumulative += n
+                samples.append(('_bucket', labels + [('le', repr(bound))],
+                                cumulative))
+            samples.append(('_bucket', labels + [('le', '+Inf')], count))
+            samples.append(('_sum', labels, total))
+            samples.append(('_count', labels, count))
+        return formatMetric(self.name, self.description,
+                            self.buckets and 'histogram' or 'counter',
+                            samples)
 
 
+# upper bounds (seconds) of the latency histogram buckets
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5,
+                   1.0, 2.5, 5.0, 10.0)
+REQUEST_LATENCY = Metric(
+    'memento_http_request_duration_seconds',
+    'Time until the response of a route is returned (streamed bodies '
+    'excluded).', ('route', 'method'), LATENCY_BUCKETS)
+REQUESTS = Metric('memento_http_requests_total',
+                  'Responses by route and status code.',
+                  ('route', 'method', 'status'))
+CALLBACK_LATENCY = Metric('memento_callback_duration_seconds',
+                          'Latency of the request processing callbacks.',
+                          ('callback',), LATENCY_BUCKETS)
+SPARQL_LATENCY = Metric('memento_sparql_query_duration_seconds',
+                        'Latency of the backend queries by operation.',
+                        ('operation',), LATENCY_BUCKETS)
+SPARQL_ERRORS = Metric('memento_sparql_errors_total',
+                       'Failed backend queries by operation.', ('operation',))
+SPARQL_REJECTED = Metric('memento_sparql_rejected_total',
+                         'Queries rejected by the concurrency limiter or '
+                         'the circuit breaker.', ('reason',))
+STALE_FALLBACKS = Metric('memento_stale_fallbacks_total',
+                         'Stale cached values served while the backend was '
+                         'unavailable.', ('cache',))
+
+
+def timedCallback(function):
+    """decorator recording the latency of a callback"""
+    @functools.wraps(function)
+    def wrapper(*args, **kwargs):
+        start = time.perf_counter()
+        try:
+            return function(*args, **kwargs)
+        finally:
+            CALLBACK_LATENCY.observe((function.__name__,),
+                                     time.perf_counter() - start)
+    return wrapper
+
+
+def executeQuery(operation, args):
+    """perform an operation on the backend and record its latency (or
+    failure)
+
+    at most sparql_max_concurrency queries are in flight; queries waiting
+    longer than sparql_queue_timeout for a slot and queries arriving while
+    the circuit breaker is open raise SparqlUnavailable, as do failed
+    requests to the endpoint. Only timeouts, connection errors and server
+    errors count as failures of the circuit breaker, queries rejected by
+    the endpoint (4xx) raise SparqlQueryError"""
+    try:
+        probe = circuit_breaker.before()
+    except SparqlUnavailable:
+        SPARQL_REJECTED.inc(('circuit_open',))
+        raise
+    if not sparql_limiter.acquire(timeout=sparql_queue_timeout):
+        circuit_breaker.after(probe, None)
+        SPARQL_REJECTED.inc(('queue_timeout',))
+        raise SparqlUnavailable('no query slot available within %ss' %
+                                sparql_queue_timeout)
+    failed = None
+    start = time.perf_counter()
+    try:
+        result = getattr(sparql_backend, operation)(*args)
+        failed = False
+        return result
+    except requests.HTTPError as e:
+        SPARQL_ERRORS.inc((operation,))
+        if e.response is not None and e.response.status_code < 500:
+            failed = False
+            raise SparqlQueryError('%s rejected: %s' % (operation, e))
+        failed = True
+        raise SparqlUnavailable('%s failed: %s' % (operation, e))
+    except requests.RequestException as e:
+        failed = True
+        SPARQL_ERRORS.inc((operation,))
+        raise SparqlUnavailable('%s failed: %s' % (operation, e))
+    except Exception:
+        SPARQL_ERRORS.inc((operation,))
+        raise
+    finally:
+        sparql_limiter.release()
+        circuit_breaker.after(probe, failed)
+        SPARQL_LATENCY.observe((operation,), time.perf_counter() - start)
+
+
+class RequestTrace(object):
+    """request-scoped memo of sparql results and trace of the queries"""
+
+    def __init__(self):
+        self.results = {}
+        self.queries = []
+        # set if stale cached values were served
+        self.stale = False
+        self._lock = threading.Lock()
+
+    def lookup(self, key):
+        """return a tuple (found, result) for a previously executed query"""
+        with self._lock:
+            if key in self.results:
+                return True, self.results[key]
+            return False, None
+
+    def record(self, key, operation, duration, result, deduplicated=False):
+        """record an executed (or deduplicated) query and its result"""
+        with self._lock:
+            self.results[key] = result
+            size = isinstance(result, list) and '%d rows' % len(result) or \
+                '%d bytes' % len(result)
+            self.queries.append((operation, duration, size, deduplicated))
+
+    def serverTiming(self):
+        """render the trace as value of a Server-Timing header"""
+        entries = ['sparql;desc="%d queries, %d deduplicated";dur=%.1f' % (
+            len(self.queries), len([q for q in self.queries if q[3]]),
+            sum([q[1] for q in self.queries]) * 1000)]
+        for n, (operation, duration, size, deduplicated) in \
+                enumerate(self.queries):
+            entries.append('sparql-%d;desc="%s %s";dur=%.1f' % (
+                n + 1, operation, deduplicated and 'deduplicated' or size,
+                duration * 1000))
+        return ', '.join(entries)
+
+    def summary(self):
+        """render the trace as a single log line"""
+        return '; '.join(['%s %.1fms %s%s' % (
+            operation, duration * 1000, size,
+            deduplicated and ' (deduplicated)' or '')
+            for operation, duration, size, deduplicated in self.queries])
+
+
+# trace of the request currently processed (None outside of requests)
+request_trace = contextvars.ContextVar('request_trace', default=None)
+
+
+def sparqlQuery(operation, *args):
+    """perform a backend operation (see SparqlClient) and return its result
+
+    identical operations are executed only once per request"""
+    trace = request_trace.get()
+    if trace is None:
+        return executeQuery(operation, args)
+    key = (operation, repr(args))
+    found, result = trace.lookup(key)
+    if found:
+        trace.record(key, operation, 0, result, True)
+        return result
+    start = time.time()
+    result = executeQuery(operation, args)
+    trace.record(key, operation, time.time() - start, result)
+    return result
+
+
+@app.before_request
+def startRequestTrace():
+    request_trace.set(RequestTrace())
+    g.request_start = time.perf_counter()
+
+
+@app.after_request
+def recordRequestMetrics(response):
+    if 'request_start' in g:
+        route = request.url_rule and request.url_rule.rule or 'unmatched'
+        REQUEST_LATENCY.observe((route, request.method),
+                                time.perf_counter() - g.request_start)
+        REQUESTS.inc((route, request.method, str(response.status_code)))
+    return response
+
+
+@app.after_request
+def addServerTiming(response):
+    trace = request_trace.get()
+    if trace is not None and trace.queries:
+        response.headers['Server-Timing'] = trace.serverTiming()
+    return response
+
+
+@app.after_request
+def addStaleWarning(response):
+    trace = request_trace.get()
+    if trace is not None and trace.stale:
+        # degraded responses must not be stored by shared caches
+        response.headers['Warning'] = '110 - "Response is Stale"'
+        response.cache_control.no_store = True
+        response.cache_control.public = None
+        response.cache_control.max_age = None
+    return response
+
+
+@app.errorhandler(SparqlUnavailable)
+def handleSparqlUnavailable(e):
+    LOGGER.warning('Backend unavailable: %s' % e)
+    response = make_response('Service Unavailable. The triple store cannot '
+                             'answer queries at the moment', 503)
+    response.headers['Retry-After'] = str(circuit_breaker.retryAfter())
+    response.cache_control.no_store = True
+    return response
+
+
+@app.errorhandler(SparqlQueryError)
+def handleSparqlQueryError(e):
+    LOGGER.warning('Query rejected: %s' % e)
+    response = make_response('Bad Request. The triple store rejected the '
+                             'query for this resource', 400)
+    response.cache_control.no_store = True
+    return response
+
+
+def markStale(cache):
+    """record that a stale value of the given cache was served"""
+    STALE_FALLBACKS.inc((cache,))
+    trace = request_trace.get()
+    if trace is not None:
+        trace.stale = True
+
+
+@app.teardown_request
+def endRequestTrace(exc=None):
+    trace = request_trace.get()
+    if trace is not None and trace.queries and \
+            LOGGER.isEnabledFor(logging.DEBUG):
+        LOGGER.debug('SPARQL trace of %s: %s' % (request.full_path,
+                                                  trace.summary()))
+    request_trace.set(None)
+
+
+class LookupCache(object):
+    """bounded in-process cache with lru eviction and time to live"""
+
+    def __init__(self, maxsize=10000, ttl=3600):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._entries = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        """return a tuple (found, value) for the given key"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[0] < time.time():
+                self.misses += 1
+                return False, None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return True, entry[1]
+
+    def getStale(self, key, max_age):
+        """return a tuple (found, value) for the given key, entries which
+        expired less than max_age seconds ago are returned as well (unless
+        their value is out of date)"""
+        with self._lock:
+            entry = self._entries.get(key)
+            now = time.time()
+            if entry is None or entry[0] + max_age < now or \
+                    entry[2] is not None and entry[2] <= now:
+                return False, None
+            return True, entry[1]
+
+    def set(self, key, value, ttl=None):
+        """store value under key and evict least recently used entries
+
+        ttl is the number of seconds until the value goes out of date (if
+        known): the entry expires then at the latest and is never returned
+        stale afterwards"""
+        with self._lock:
+            now = time.time()
+            outdated = ttl is not None and now + ttl or None
+            expires = now + self.ttl
+            if outdated is not None:
+                expires = min(expires, outdated)
+            self._entries[key] = (expires, value, outdated)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, key=None):
+        """remove the entry of the given key (or all entries)"""
+        with self._lock:
+            if key is None:
+                self._entries.clear()
+            else:
+                self._entries.pop(key, None)
+
+    def invalidateWhere(self, predicate):
+        """remove all entries whose key matches the predicate"""
+        with self._lock:
+            for key in [key for key in self._entries if predicate(key)]:
+                del self._entries[key]
+
+    def stats(self):
+        """return size and hit/miss counters of the cache"""
+        with self._lock:
+            return {'size': len(self._entries), 'hits': self.hits,
+                    'misses': self.misses}
+
+
+# caches of structural facts about the cdm hierarchy, keyed by uri
+LOOKUP_CACHES = {}
+
+
+def cachedLookup(name, expiring=False):
+    """decorator caching the results of a single-uri lookup function
+
+    an expiring lookup function returns a tuple (value, seconds until the
+    value becomes invalid or None)"""
+    cache = LOOKUP_CACHES[name] = LookupCache(lookup_cache_size,
+                                              lookup_cache_ttl)
+
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(uri):
+            found, value = cache.get(uri)
+            if not found:
+                try:
+                    value = func(uri)
+                except SparqlUnavailable:
+                    # serve the last known good value (stale-while-error)
+                    found, value = cache.getStale(uri, stale_max_age)
+                    if not found:
+                        raise
+                    markStale(name)
+                else:
+                    ttl = None
+                    if expiring:
+                        value, ttl = value
+                    cache.set(uri, value, ttl)
+            return value
+        wrapper.cache = cache
+        return wrapper
+    return decorator
+
+
+def invalidateLookups(uri=None):
+    """drop cached lookups for the given uri (or all cached lookups)"""
+    for cache in LOOKUP_CACHES.values():
+        cache.invalidate(uri)
+
+
+sparql_executor = concurrent.futures.ThreadPoolExecutor(
+    max_workers=sparql_fanout_workers)
+batch_executor = concurrent.futures.ThreadPoolExecutor(
+    max_workers=batch_workers)
+
+
+def sparqlQueries(queries):
+    """perform independent backend operations concurrently (results in
+    order)
+
+    queries is a list of (operation, arguments) tuples"""
+    # workers share the trace of the current request
+    futures = [sparql_executor.submit(contextvars.copy_context().run,
+                                      sparqlQuery, operation, *args)
+               for operation, args in queries]
+    return [future.result() for future in futures]
+
+
+def sparqlValuesQuery(operation, uris):
+    """perform a backend operation on many uris (bound in VALUES blocks)
+
+    the uris are split into batches which are queried concurrently"""
+    batches = [uris[i:i + sparql_values_batch_size]
+               for i in range(0, len(uris), sparql_values_batch_size)]
+    if len(batches) == 1:
+        return sparqlQuery(operation, batches[0])
+    bindings = []
+    for sparql_results in sparqlQueries([(operation, (batch,))
+                                         for batch in batches]):
+        bindings.extend(sparql_results)
+    return bindings
+
+
+def sparqlPagedQuery(operation, page_size):
+    """perform a backend operation page by page (LIMIT/OFFSET) and return
+    all rows"""
+    bindings = []
+    offset = 0
+    while True:
+        page = sparqlQuery(operation, page_size, offset)
+        bindings.extend(page)
+        if len(page) < page_size:
+            return bindings
+        offset += page_size
+
+
+@cachedLookup('uri_r')
 def get_uri_r(uri):
     """retrieves URI of the related original resource"""
-    query = URI_R_TEMPLATE % {'uri': uri}
-    sparql_results = sparqlQuery(query)
+    sparql_results = sparqlQuery('uriR', uri)
     # global uri_g
     if not sparql_results:
         return None
-    uri_g = sparql_results[0]['predecessor']['value']
+    uri_g = sparql_results[0]['predecessor']
     return uri_g
 
 
@@ -149,21 +1023,29 @@ def get_uri_r(uri):
 def processMementoRequest(id=None):
     """process memento service request (non-information resources)"""
     response = None
+    if not isValidId(id):
+        return make_response('Not Found. Invalid celex id', 404)
     uri = CELLAR_PREFIX + id
-    # get URI of Original Resource
-    uri_r = get_uri_r(uri)
     # return memento (target resource is not a complex work)
     if not(isEvolutiveWork(uri)) or request.args.get('rel') == '404':
         response = nonInformationResourceCallback(uri, request.args.get('rel') == '404')
         return response
 
+    # get URI of Original Resource
+    uri_r = get_uri_r(uri)
     LOGGER.debug("URI-R: %s" % uri_r)
     # uri matches a complex work and the rel parameter is set to 'timemap'
     #if request.args.get('rel') == 'timemap': response = timemapCallback(uri, uri_r)
 
+    prefer_follow = followPreferred()
+    # the client asks to follow all redirects (follow=1 or Prefer: follow)
+    if request.args.get('follow') in ('1', 'true') or prefer_follow:
+        response = followCallback(uri, uri_r)
+        if prefer_follow:
+            response.headers['Preference-Applied'] = 'follow'
     # uri matches an intermediate resource and the rel parameter is set to
     # 'intermediate'
-    if request.args.get('rel') == 'intermediate':
+    elif request.args.get('rel') == 'intermediate':
         response = intermediateResourceCallback(uri_r)
     # uri matches a timegate resource (uri != uri_r)
     elif uri != uri_r:
@@ -171,6 +1053,7 @@ def processMementoRequest(id=None):
     # uri matches original resource
     else:
         response = originalResourceCallback(uri_r)
+    response.vary.add('Prefer')
     return response
 
 
@@ -179,6 +1062,8 @@ def processDataRequest(id=None):
     """process data representation request (information resources)"""
     LOGGER.debug('Processing data request ...')
     response = None
+    if not isValidId(id):
+        return make_response('Not Found. Invalid celex id', 404)
     uri = CELLAR_PREFIX + id
     if id.endswith('.txt'):
         # return application/link-format
@@ -189,27 +1074,142 @@ def processDataRequest(id=None):
     return response
 
 
+@app.route('/memento/batch', methods=['POST'])
+def processBatchRequest():
+    """resolve many (id, accept-datetime) pairs in a single request
+
+    expects a JSON list of {"id": ..., "datetime": ...} objects (datetime
+    is an optional HTTP-date, "rel": "intermediate" negotiates at the
+    timegate of an original resource) and streams the results as JSON or
+    NDJSON as soon as they are resolved. Every item resolves to the memento
+    of the corresponding ?follow=1 request"""
+    LOGGER.debug('Processing batch request ...')
+    items = request.get_json(silent=True)
+    if isinstance(items, dict):
+        items = items.get('items')
+    if not isinstance(items, list) or \
+            not all(isinstance(i, dict) and 'id' in i for i in items):
+        return make_response('Bad Request. Expected a JSON list of '
+                             '{"id": ..., "datetime": ...} objects', 400)
+    if len(items) > batch_max_items:
+        return make_response('Request Entity Too Large. At most %d items '
+                             'per batch' % batch_max_items, 413)
+    ndjson = request.accept_mimetypes.best_match(
+        ['application/json', 'application/x-ndjson']) == \
+        'application/x-ndjson'
+    items = list(enumerate(items))
+    futures = [batch_executor.submit(contextvars.copy_context().run,
+                                     resolveBatch, items[i:i + batch_chunk_size])
+               for i in range(0, len(items), batch_chunk_size)]
+
+    def generateResults():
+        separator = ''
+        if not ndjson:
+            yield '['
+        for future in concurrent.futures.as_completed(futures):
+            for result in future.result():
+                if ndjson:
+                    yield json.dumps(result) + '\n'
+                else:
+                    yield separator + json.dumps(result)
+                    separator = ','
+        if not ndjson:
+            yield ']'
+    return app.response_class(stream_with_context(generateResults()), 200,
+                              mimetype=ndjson and 'application/x-ndjson' or
+                              'application/json')
+
+
+@app.route('/invalidate', methods=['POST'])
+def processInvalidationRequest():
+    """evict the cached state of works modified in the triple store
+
+    expects a JSON list of celex ids or uris (push notification of a change
+    feed) with the invalidation_token as bearer token, from one of the
+    invalidation_webhook_hosts. With several worker processes a
+    notification only reaches one of them, poll the fingerprints
+    (invalidation_poll_interval) there"""
+    LOGGER.debug('Processing invalidation request ...')
+    if not invalidation_token:
+        return make_response('Not Found. The webhook is disabled', 404)
+    authorization = request.headers.get('Authorization', '')
+    if not authorization.startswith('Bearer ') or \
+            not hmac.compare_digest(authorization[7:].encode('utf-8'),
+                                    invalidation_token.encode('utf-8')):
+        response = make_response('Unauthorized', 401)
+        response.headers['WWW-Authenticate'] = 'Bearer'
+        return response
+    if request.remote_addr not in invalidation_webhook_hosts:
+        return make_response('Forbidden', 403)
+    items = request.get_json(silent=True)
+    if isinstance(items, dict):
+        items = items.get('items')
+    if not isinstance(items, list) or \
+            not all(isinstance(i, str) and isValidId(i) for i in items):
+        return make_response('Bad Request. Expected a JSON list of celex '
+                             'ids or uris', 400)
+    uris = [i if '://' in i else CELLAR_PREFIX + i for i in items]
+    response = make_response(json.dumps({'evicted': invalidateWorks(uris)}),
+                             200)
+    response.mimetype = 'application/json'
+    response.cache_control.no_store = True
+    return response
+
+
+@app.route('/metrics')
+def processMetricsRequest():
+    """expose the metrics of this process in prometheus text format
+
+    with several worker processes a scrape reaches one of them, the pid
+    label tells their series apart (aggregate with sum without (pid))"""
+    caches = sorted(LOOKUP_CACHES.items()) + [
+        ('representation', representation_cache), ('timemap', timemap_cache),
+        ('negotiation', negotiation_cache)]
+    stats = [([('cache', name)], cache.stats()) for name, cache in caches]
+    body = ''.join([metric.render() for metric in (
+        REQUEST_LATENCY, REQUESTS, CALLBACK_LATENCY, SPARQL_LATENCY,
+        SPARQL_ERRORS, SPARQL_REJECTED, STALE_FALLBACKS)])
+    body += formatMetric(
+        'memento_circuit_breaker_open',
+        'Whether the circuit breaker of the backend is open.', 'gauge',
+        [('', [], circuit_breaker.isOpen() and 1 or 0)])
+    body += formatMetric('memento_cache_hits_total', 'Cache hits.', 'counter',
+                         [('', labels, i['hits']) for labels, i in stats])
+    body += formatMetric('memento_cache_misses_total', 'Cache misses.',
+                         'counter',
+                         [('', labels, i['misses']) for labels, i in stats])
+    body += formatMetric('memento_cache_entries', 'Cached entries.', 'gauge',
+                         [('', labels, i['size']) for labels, i in stats])
+    body += formatMetric(
+        'memento_cache_hit_ratio', 'Ratio of cache hits to lookups.',
+        'gauge', [('', labels, float(i['hits']) / (i['hits'] + i['misses'])
+                   if i['hits'] + i['misses'] else 0) for labels, i in stats])
+    response = make_response(body, 200)
+    response.mimetype = 'text/plain'
+    response.headers['Content-Type'] = 'text/plain; version=0.0.4; ' \
+                                       'charset=utf-8'
+    response.cache_control.no_store = True
+    return response
+
+
+@timedCallback
 def originalResourceCallback(uri_r):
     """processing logic when requesting an original resource"""
     LOGGER.debug('Executing originalResourceCallback...')
     # return redirection object
     localhost_uri_i = toLocalhostUri(uri_r + '?rel=intermediate')
-    # current timestamp
-    now = time.strftime("%Y-%m-%dT%XZ")
-    location = uri_r
     # cascading selection of most recent representation
-    while isEvolutiveWork(location):
-        location = getLocation(location, now)
-        if location == None:
-            break
+    chain, location = getMostRecent(uri_r)
     redirect_obj = redirect(toLocalhostUri(location), code=303)
     redirect_obj.headers['Link'] = '<%(localhost_uri_i)s>; rel="timegate", ' \
                                    '<%(localhost_uri_t)s>; rel="timemap"' % \
                                    {'localhost_uri_i': localhost_uri_i,
                                     'localhost_uri_t': toLocalhostUri(uri_r + '?rel=timemap')}
+    setCacheHeaders(redirect_obj, timegate_max_age)
     return redirect_obj
 
 
+@timedCallback
 def intermediateResourceCallback(uri_r):
     """processing logic when requesting an intermediate resource"""
     LOGGER.debug('Executing intermediateResourceCallback...')
@@ -222,14 +1222,8 @@ def intermediateResourceCallback(uri_r):
         location = getLocation(uri_r, accept_datetime)
     # redirect to most recent representation
     else:
-        # current timestamp
-        now = time.strftime("%Y-%m-%dT%XZ")
-        location = uri_r
         # cascading selection of most recent representation
-        while isEvolutiveWork(location):
-            location = getLocation(location, now)
-            if location == None:
-                break
+        chain, location = getMostRecent(uri_r)
     if location == None:
         return make_response("Bad Request. Check your query parameters", 406)
     # link headers
@@ -242,9 +1236,11 @@ def intermediateResourceCallback(uri_r):
                                     'localhost_uri_g': toLocalhostUri(uri_r + '?rel=intermediate'),
                                     'localhost_uri_t': toLocalhostUri(uri_r + '?rel=timemap')
                                    }
+    setCacheHeaders(redirect_obj, timegate_max_age, vary='Accept-Datetime')
     return redirect_obj
 
 
+@timedCallback
 def timegateCallback(uri):
     """processing logic when requesting a timegate"""
     LOGGER.debug('Executing timegateCallback...')
@@ -256,12 +1252,13 @@ def timegateCallback(uri):
     location = getLocation(uri, accept_datetime)
     location = (location == None) and uri + '?rel=404' or location
     # link headers
-    localhost_uri_r = toLocalhostUri(get_uri_r(uri))
+    uri_r = get_uri_r(uri)
+    localhost_uri_r = toLocalhostUri(uri_r)
     localhost_uri_g = toLocalhostUri(uri)
     # timemap associated with 'local' timegate
     localhost_uri_t_l = localhost_uri_g + '?rel=timemap'
     # timemap associated with 'global' original resource
-    localhost_uri_t_r = toLocalhostUri(get_uri_r(uri)+'?rel=timemap')
+    localhost_uri_t_r = toLocalhostUri(uri_r+'?rel=timemap')
     # redirection object
     redirect_obj = redirect(toLocalRedirectUri(location), code=302)
     redirect_obj.headers['Vary'] = 'accept-datetime'
@@ -273,16 +1270,77 @@ def timegateCallback(uri):
             'localhost_uri_g': localhost_uri_g,
             'localhost_uri_t_l': localhost_uri_t_l,
             'localhost_uri_t_r': localhost_uri_t_r}
+    setCacheHeaders(redirect_obj, timegate_max_age, vary='Accept-Datetime')
     return redirect_obj
 
 
+@timedCallback
+def followCallback(uri, uri_r):
+    """processing logic when the client asks to follow all redirects
+
+    the whole cascade of timegates is resolved internally and a single
+    redirect to the data representation of the negotiated memento is
+    returned, its Link header merges the links of all traversed resources"""
+    LOGGER.debug('Executing followCallback...')
+    intermediate = request.args.get('rel') == 'intermediate'
+    start = intermediate and uri_r or uri
+    # the original resource always selects the most recent representation
+    if (intermediate or uri != uri_r) and 'Accept-Datetime' in request.headers:
+        accept_datetime = parseHTTPDate(request.headers['Accept-Datetime'])
+        LOGGER.debug('Accept-Datetime: %s' % accept_datetime)
+        chain, location = resolveCascade(start, accept_datetime)
+    else:
+        chain, location = getMostRecent(start)
+    if not chain:
+        return make_response("Bad Request. Check your query parameters", 406)
+    if location == None:
+        # redirect to 404 memento of the last timegate
+        redirect_obj = redirect(toLocalRedirectUri(chain[-1] + '?rel=404'),
+                                code=302)
+    else:
+        redirect_obj = redirect(toLocalRedirectDataUri(location, '.xml'),
+                                code=303)
+    redirect_obj.headers['Link'] = ', '.join(
+        ['<%s>; rel="%s"' % link for link in cascadeLinks(uri_r, chain,
+                                                          location)])
+    setCacheHeaders(redirect_obj, timegate_max_age, vary='Accept-Datetime')
+    return redirect_obj
+
+
+def cascadeLinks(uri_r, chain, location):
+    """return the (uri, rel) pairs linking the resources traversed by a
+    cascade: original resource, timegates and timemaps of the chain and the
+    memento (if any)"""
+    links = [(toLocalhostUri(uri_r), 'original')]
+    for work in chain:
+        links.append((toLocalhostUri(
+            work == uri_r and uri_r + '?rel=intermediate' or work),
+            'timegate'))
+        links.append((toLocalhostUri(work + '?rel=timemap'), 'timemap'))
+    if location != None:
+        links.append((toLocalhostUri(location), 'memento'))
+    return links
+
+
+def followPreferred():
+    """test whether the request carries a Prefer: follow header"""
+    for value in request.headers.getlist('Prefer'):
+        for preference in value.split(','):
+            if preference.split(';')[0].split('=')[0].strip().lower() == \
+                    'follow':
+                return True
+    return False
+
+
+@timedCallback
 def nonInformationResourceCallback(uri,handle_404=False):
     """processing logic when requesting a non-information resource"""
     LOGGER.debug('Executing nonInformationResourceCallback...')
-    localhost_uri_r = toLocalhostUri(get_uri_r(uri))
+    uri_r = get_uri_r(uri)
+    localhost_uri_r = toLocalhostUri(uri_r)
     # timemap associated with 'global' original resource
-    localhost_uri_t_r = toLocalhostUri(get_uri_r(uri)+'?rel=timemap')
-    localhost_uri_g = toLocalhostUri(get_uri_r(uri)+'?rel=intermediate')
+    localhost_uri_t_r = toLocalhostUri(uri_r+'?rel=timemap')
+    localhost_uri_g = toLocalhostUri(uri_r+'?rel=intermediate')
     localhost_uri_t_g = response = None
     # this is actually a request on a 404 object
     if handle_404:
@@ -295,6 +1353,8 @@ def nonInformationResourceCallback(uri,handle_404=False):
     else:
         # redirect to concrete data representation (information resource)
         response = redirect(toLocalRedirectDataUri(uri, '.xml'), code=303)
+        # mementos never change
+        setCacheHeaders(response, memento_max_age, immutable=True)
          # timemap associated with 'local' timegate
         localhost_uri_t_g = toLocalhostUri(getPredecessor(uri)+ '?rel=timemap')
     # set headers
@@ -312,12 +1372,11 @@ def nonInformationResourceCallback(uri,handle_404=False):
 
 def getMementoDatetime(uri, handle_404):
     """return response containing memento-datetime for a given resource"""
-    memento_datemtime_query = MEMENTO_DATETIME_TEMPLATE % \
-                              {'uri': uri + ((handle_404) and '?rel=404' or '')}
-    sparql_results = sparqlQuery(memento_datemtime_query)
+    sparql_results = sparqlQuery(
+        'mementoDatetime', uri + ((handle_404) and '?rel=404' or ''))
     response = None
     try:
-        memento_datetime = sparql_results[0]['date']['value']
+        memento_datetime = sparql_results[0]['date']
         response = make_response(memento_datetime, 303)
     except:
         response = make_response(
@@ -325,14 +1384,35 @@ def getMementoDatetime(uri, handle_404):
     return response
 
 
+@timedCallback
 def dataRepresentationCallback(uri, linkformat):
     """processing logic when requesting a data representation (information resource)"""
     LOGGER.debug('Executing dataRepresentationCallback...')
     # timemap request
     if linkformat:
-        tm = generateLinkformatTimemap(uri)
-        response = make_response(tm, 200)
-        response.headers['Content-Type'] = 'application/link-format; charset=utf-8'
+        page = request.args.get('page', type=int)
+        if 'page' in request.args and (page is None or page < 1):
+            return make_response('Bad Request. The page must be a positive '
+                                 'integer', 400)
+        # serve materialized timemap if available
+        if timemap_store is not None and timemap_page_size <= 0 and \
+                timemap_store.has(uri):
+            response = timemap_store.serve(uri)
+        else:
+            try:
+                tm = keepTimemap((uri, page),
+                                 generateLinkformatTimemap(uri, page))
+            except SparqlUnavailable:
+                # serve the last known good timemap (stale-while-error)
+                found, body = timemap_cache.getStale((uri, page),
+                                                     stale_max_age)
+                if not found:
+                    raise
+                markStale('timemap')
+                tm = iter([body])
+            response = app.response_class(stream_with_context(tm), 200)
+            response.headers['Content-Type'] = 'application/link-format; charset=utf-8'
+        setCacheHeaders(response, timemap_max_age)
     # memento request
     else:
         uri_r = get_uri_r(uri)
@@ -341,13 +1421,28 @@ def dataRepresentationCallback(uri, linkformat):
         localhost_uri_t = toLocalhostUri(uri_t  + '?rel=timemap')
         localhost_uri_g = toLocalhostUri(uri_g)
 
-        describe_query = DESCRIBE_TEMPLATE % {'uri': uri}
-        describe_sparql_results = sparqlQuery(describe_query, format='application/rdf+xml')
-        memento_dt_query = MEMENTO_DATETIME_TEMPLATE % {'uri': uri }
-        memento_dt_sparql_results = sparqlQuery(memento_dt_query)
-        memento_dt = memento_dt_sparql_results[0]['date']['value']
-        response = make_response(describe_sparql_results, 200)
-        response.headers['Content-Type'] = 'application/rdf+xml; charset=utf-8'
+        memento_dt = getMementoDatetimeValue(uri)
+        if memento_dt is None:
+            return make_response('Not Found', 404)
+        mimetype = negotiateDataFormat()
+        encoding = negotiateContentEncoding()
+        # mementos are immutable, their validators derive from the
+        # memento-datetime (no need to describe the memento for a 304)
+        etag = hashlib.sha1(('%s|%s|%s|%s' % (uri, memento_dt, mimetype,
+                                              encoding)).encode(
+            'utf-8')).hexdigest()
+        if isNotModified(etag, stringToHTTPDate(memento_dt)):
+            response = make_response('', 304)
+        else:
+            encoding, body = describeRepresentation(uri, mimetype, encoding)
+            response = make_response(body, 200)
+            response.headers['Content-Type'] = mimetype + '; charset=utf-8'
+            if encoding:
+                response.headers['Content-Encoding'] = encoding
+        response.vary.update(['Accept', 'Accept-Encoding'])
+        response.set_etag(etag)
+        response.headers['Last-Modified'] = stringToHTTPDate(memento_dt)
+        setCacheHeaders(response, memento_max_age, immutable=True)
         response.headers['Memento-Datetime'] = stringToHTTPDate(memento_dt)
         response.headers['Link'] = \
             '<%(localhost_uri_r)s>; rel="original", ' \
@@ -359,103 +1454,803 @@ def dataRepresentationCallback(uri, linkformat):
     return response
 
 
-def generateLinkformatTimemap(uri):
-    """generate timemap in link-value format"""
-    # get related timemaps
-    query_tm = RELATED_EVOLUTIVE_WORKS % {'uri': uri}
-    tm_results = sparqlQuery(query_tm)
-    # get related original timegate
-    query_ot = URI_R_TEMPLATE % {'uri': uri}
-    ot_results = sparqlQuery(query_ot)
-    # get related mementos
-    query_m = RELATED_MEMENTOS % {'uri': uri}
-    m_results = sparqlQuery(query_m)
-    # get startdate, enddate and type of date
+# last known good timemaps served while the backend is unavailable, keyed
+# by (uri, page)
+timemap_cache = LookupCache(timemap_cache_size, timemap_max_age)
+
+
+def keepTimemap(key, lines):
+    """pass the lines of a timemap through and keep the complete timemap
+    (if not too large) as fallback"""
+    kept = []
+    size = 0
+    for line in lines:
+        if size <= timemap_cache_max_size:
+            kept.append(line)
+            size += len(line)
+        yield line
+    if size <= timemap_cache_max_size:
+        timemap_cache.set(key, ''.join(kept))
+
+
+def negotiateDataFormat():
+    """select the rdf serialization of a data representation (Accept header)
+
+    among equally acceptable serializations the most compact one wins;
+    without explicit preference the representation is rdf/xml"""
+    accepted = dict(request.accept_mimetypes)
+    candidates = [(accepted[mimetype], -n, mimetype)
+                  for n, mimetype in enumerate(DATA_FORMATS)
+                  if accepted.get(mimetype, 0) > 0]
+    if not candidates:
+        return 'application/rdf+xml'
+    return max(candidates)[2]
+
+
+def negotiateContentEncoding():
+    """select the content coding of a response (Accept-Encoding header)"""
+    if brotli is not None and request.accept_encodings['br'] > 0:
+        return 'br'
+    if request.accept_encodings['gzip'] > 0:
+        return 'gzip'
+    return None
+
+
+# compressed data representations of mementos, keyed by (uri, mimetype,
+# encoding)
+representation_cache = LookupCache(representation_cache_size,
+                                   memento_max_age)
+
+
+def describeRepresentation(uri, mimetype, encoding=None):
+    """return the (compressed) data representation of a memento
+
+    returns a tuple (applied encoding, body)"""
+    key = (uri, mimetype, encoding)
+    found, value = representation_cache.get(key)
+    if found:
+        return value
+    try:
+        body = sparqlQuery('describe', uri,
+                           DATA_FORMATS[mimetype]).encode('utf-8')
+    except SparqlUnavailable:
+        # serve the last known good representation (stale-while-error)
+        found, value = representation_cache.getStale(key, stale_max_age)
+        if not found:
+            raise
+        markStale('representation')
+        return value
+    if encoding is None or len(body) < compression_min_size:
+        encoding = None
+    elif encoding == 'br':
+        body = brotli.compress(body, quality=6)
+    else:
+        body = gzip.compress(body, 6)
+    representation_cache.set(key, (encoding, body))
+    return encoding, body
+
+
+def setCacheHeaders(response, max_age, immutable=False, vary=None):
+    """allow shared caches to store the response for max_age seconds"""
+    response.cache_control.no_cache = None
+    response.cache_control.public = True
+    response.cache_control.max_age = max_age
+    if immutable:
+        response.cache_control.immutable = True
+    if vary:
+        response.vary.add(vary)
+
+
+def isNotModified(etag, last_modified):
+    """check the conditional request headers against the given validators"""
+    if request.if_none_match:
+        return request.if_none_match.contains_weak(etag)
+    if request.if_modified_since is not None:
+        return request.if_modified_since >= eut.parsedate_to_datetime(
+            last_modified)
+    return False
+
+
+def generateLinkformatTimemap(uri, page=None, page_size=None):
+    """generate timemap in link-value format
+
+    returns a generator yielding the timemap line by line. If paging is
+    enabled (timemap_page_size), only the mementos of the given page are
+    listed together with links to the previous and next page"""
+    if page_size is None:
+        page_size = timemap_page_size
+    if page_size > 0:
+        page = page or 1
+        # fetch one additional memento to find out whether there is a next page
+        offset, limit = (page - 1) * page_size, page_size + 1
+    else:
+        page = None
+        offset, limit = 0, timemap_chunk_size
+    # get related timemaps, related original timegate and the first
+    # related mementos concurrently
+    tm_results, ot_results, m_results = sparqlQueries([
+        ('relatedEvolutiveWorks', (uri,)),
+        ('uriR', (uri,)),
+        ('relatedMementos', (uri, limit, offset))])
+    # get startdate, enddate and type of date of all timemaps at once
     timemap_list = [uri]
-    timemap_list.append(uri)
     for i in tm_results:
-        timemap_list.append(i['evolutive_work']['value'])
+        if i['evolutive_work'] not in timemap_list:
+            timemap_list.append(i['evolutive_work'])
+    timemap_info = getTimemapInfo(timemap_list)
+    # all timemap links are formatted before streaming starts, so that
+    # errors surface as a normal error response
+    tm_links = [formatTimemapLink(i['evolutive_work'], 'timemap',
+                                  timemap_info) for i in tm_results]
+    self_link = formatTimemapLink(uri, 'self', timemap_info)
+    has_next = page is not None and len(m_results) > page_size
+    if has_next:
+        m_results = m_results[:page_size]
+
+    def generateLines(m_results, offset):
+        # add link to the original timegate
+        for i in ot_results:
+            yield '<' + toLocalhostUri(i['predecessor']) + \
+                  '>;rel="original"\n'
+        # add link for each memento (fetching further chunks if not paged)
+        while m_results:
+            dates = stringsToHTTPDates([i['date'] for i in m_results])
+            yield ''.join(['<' + toLocalhostUri(i['memento']) +
+                           '>;rel="memento";datetime="' + date + '"\n'
+                           for i, date in zip(m_results, dates)])
+            if page is not None or len(m_results) < limit:
+                break
+            offset += limit
+            m_results = sparqlQuery('relatedMementos', uri, limit, offset)
+        # add link for timemaps
+        for link in tm_links:
+            yield link + '\n'
+        # add links to the neighbouring pages
+        if page is not None and page > 1:
+            yield '<' + toLocalhostDataUri(uri, '.txt') + '?page=%d' % \
+                  (page - 1) + '>;rel="prev";type="application/link-format"\n'
+        if has_next:
+            yield '<' + toLocalhostDataUri(uri, '.txt') + '?page=%d' % \
+                  (page + 1) + '>;rel="next";type="application/link-format"\n'
+        # add link to self
+        yield self_link
+    return generateLines(m_results, offset)
+
+
+def formatTimemapLink(uri, rel, timemap_info):
+    """format the link to the timemap of an evolutive work
+
+    works without dated members have no TIMEMAPINFO row, their links carry
+    no from, until and dtype attributes"""
+    link = '<' + toLocalhostUri(uri) + '?rel=timemap>;rel="' + rel + \
+        '";type="application/link-format"'
+    info = timemap_info.get(uri)
+    if info is not None:
+        link += ';from="' + stringToHTTPDate(info[0]) + '"' \
+            + ';until="' + stringToHTTPDate(info[1]) + '"' \
+            + ';dtype="' + str(info[2]) + '"'
+    return link
+
+
+def getTimemapInfo(uris):
+    """return startdate, enddate and type of date for each evolutive work"""
     timemap_info = {}
-    for i in timemap_list:
-        query_tminfo = TIMEMAPINFO % {'uri': i}
-        tminfo_results = sparqlQuery(query_tminfo)
-        timemap_info[toLocalhostUri(i)] = \
-            (stringToHTTPDate(tminfo_results[0]['startdate']['value']),
-             stringToHTTPDate(tminfo_results[0]['enddate']['value']),
-             tminfo_results[0]['typeofdate']['value'])
-    # add link to the original timegate
-    response_body = ''.join(
-        ['<' + toLocalhostUri(i['predecessor']['value']) + '>;rel="original"\n' for i in ot_results])
-    # add link for each memento
-    response_body += ''.join(['<' + toLocalhostUri(i['memento']['value']) +
-                              '>;rel="memento";datetime="' +
-                              stringToHTTPDate(i['date']['value']) + '"\n' for i in m_results])
-    # add link for timemaps
-    response_body += ''.join(['<' + toLocalhostUri(i['evolutive_work']['value'])
-                              +
-                              '?rel=timemap>;rel="timemap";type="application/link-format"'
-                              + ';from="'
-                              +
-                              str(timemap_info[
-                                  toLocalhostUri(i['evolutive_work']['value'])][0]) + '"'
-                              + ';until="'
-                              +
-                              str(timemap_info[
-                                  toLocalhostUri(i['evolutive_work']['value'])][1]) + '"'
-                              + ';dtype="' +
-                              str(timemap_info[
-                                  toLocalhostUri(i['evolutive_work']['value'])][2])
-                              + '"\n' for i in tm_results])
-    # add link to self
-    response_body += '<' + toLocalhostUri(uri) + \
-                     '?rel=timemap>;rel="self";type="application/link-format"' \
-                     + ';from="' + str(timemap_info[toLocalhostUri(uri)][0]) + '"' \
-                     + ';until="' + str(timemap_info[toLocalhostUri(uri)][1]) + '"' \
-                     + ';dtype="' + str(timemap_info[toLocalhostUri(uri)][2]) + '"'
-    return response_body
+    for i in sparqlValuesQuery('timemapInfo', uris):
+        timemap_info[i['work']] = (i['startdate'], i['enddate'],
+                                   i['typeofdate'])
+    return timemap_info
+
+
+class TimemapStore(object):
+    """materialized link-format timemaps of evolutive works on disk"""
+
+    def __init__(self, directory, workers=4):
+        self.directory = directory
+        self.workers = workers
+        self.index_path = os.path.join(directory, 'index.json')
+        self._lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+
+    def path(self, uri):
+        """return the file path of the timemap of the given work"""
+        name = uri.startswith(CELLAR_PREFIX) and uri[len(CELLAR_PREFIX):] \
+            or uri
+        return os.path.join(self.directory,
+                            urllib.parse.quote(name, safe='') + '.txt')
+
+    def has(self, uri):
+        """check whether a timemap has been materialized for the given work"""
+        return os.path.isfile(self.path(uri))
+
+    def serve(self, uri):
+        """return the stored timemap (honoring conditional requests)"""
+        response = send_file(self.path(uri),
+                             mimetype='application/link-format',
+                             conditional=True, etag=True)
+        del response.headers['Content-Disposition']
+        response.headers['Content-Type'] = \
+            'application/link-format; charset=utf-8'
+        return response
+
+    def write(self, uri):
+        """(re)build the timemap of the given work"""
+        path = self.path(uri)
+        tmp_path = '%s.%d.tmp' % (path, threading.get_ident())
+        try:
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                f.writelines(generateLinkformatTimemap(uri, page_size=0))
+            os.replace(tmp_path, path)
+        except Exception:
+            # do not leave partial timemaps behind
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+
+    def remove(self, uri):
+        """remove the timemap of the given work"""
+        try:
+            os.remove(self.path(uri))
+        except FileNotFoundError:
+            pass
+
+    def loadIndex(self):
+        """return the fingerprints recorded by the last refresh"""
+        try:
+            with open(self.index_path, encoding='utf-8') as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return {'refreshed': None, 'works': {}}
+
+    def saveIndex(self, index):
+        """record the fingerprints of the materialized timemaps"""
+        tmp_path = self.index_path + '.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(index, f, indent=1, sort_keys=True)
+        os.replace(tmp_path, self.index_path)
 
+    def refresh(self, full=False):
+        """rebuild the timemaps of all works touched since the last refresh
 
+        a work is touched if its fingerprint changed; the related works of a
+        touched work are rebuilt as well since their timemaps link to it.
+        Returns the works whose timemaps have been rebuilt successfully"""
+        with self._lock:
+            index = full and {'refreshed': None, 'works': {}} or \
+                self.loadIndex()
+            fingerprints = getTimemapFingerprints()
+            touched = [uri for uri, fingerprint in fingerprints.items()
+                       if index['works'].get(uri) != fingerprint or
+                       not self.has(uri)]
+            removed = [uri for uri in index['works'] if uri not in
+                       fingerprints]
+            rebuild = set(touched)
+            if index['works']:
+                for sparql_results in sparqlQueries(
+                        [('relatedEvolutiveWorks', (uri,))
+                         for uri in touched + removed]):
+                    rebuild.update(i['evolutive_work']
+                                   for i in sparql_results)
+            rebuild = [uri for uri in rebuild if uri in fingerprints]
+            for uri in removed:
+                self.remove(uri)
+            rebuilt = []
+            failed = []
+            with concurrent.futures.ThreadPoolExecutor(
+                    max_workers=self.workers) as executor:
+                for uri, future in [(uri, executor.submit(self.write, uri))
+                                    for uri in rebuild]:
+                    try:
+                        future.result()
+                    except Exception:
+                        LOGGER.exception('Materializing timemap of %s '
+                                         'failed' % uri)
+                        # retried by the next refresh
+                        fingerprints.pop(uri, None)
+                        failed.append(uri)
+                    else:
+                        rebuilt.append(uri)
+            self.saveIndex({'refreshed': time.strftime("%Y-%m-%dT%XZ"),
+                            'works': fingerprints})
+            LOGGER.info('Timemap store refreshed: %d rebuilt, %d failed, %d '
+                        'removed' % (len(rebuilt), len(failed), len(removed)))
+            return rebuilt
+
+
+timemap_store = timemap_store_dir and \
+    TimemapStore(timemap_store_dir, timemap_store_workers) or None
+
+
+def getTimemapFingerprints():
+    """return a fingerprint of each evolutive work"""
+    return dict((i['work'], '%s|%s' % (i['members'], i.get('lastdate', '')))
+                for i in sparqlPagedQuery('timemapFingerprints',
+                                          sparql_page_size))
+
+
+@cachedLookup('evolutive_work')
 def isEvolutiveWork(uri):
     """check whether the uri represents an instance of type cdm:complex_work"""
-    query = EVOLUTIVE_WORK_TEMPLATE % {'uri': uri}
-    sparql_results = sparqlQuery(query)
-    LOGGER.debug(sparql_results == [])
+    sparql_results = sparqlQuery('evolutiveWork', uri)
     return (sparql_results != [])
 
 
+@cachedLookup('datetime_property')
 def getDatetimeProperty(uri):
     """determine the cdm property used for datetime negotiation"""
-    query = DATETIME_PROPERTY_TEMPLATE % {'uri': uri}
-    sparql_results = sparqlQuery(query)
-    datetime_property = sparql_results[0]['prop']['value']
+    sparql_results = sparqlQuery('datetimeProperty', uri)
+    datetime_property = sparql_results[0]['prop']
     LOGGER.debug("Datetime negotiation property: %s" % datetime_property)
     return datetime_property
 
 
+# last known good negotiation results served while the backend is
+# unavailable, keyed by (uri, accept_datetime)
+negotiation_cache = LookupCache(negotiation_cache_size, timegate_max_age)
+
+
 def getLocation(uri, accept_datetime):
     """determine the location information for next redirect"""
-    query = LOCATION_TEMPLATE % {'uri': uri, 'accept_datetime': accept_datetime}
-    sparql_results = sparqlQuery(query)
+    indexed, location = temporal_index.lookup(uri, accept_datetime)
+    if indexed:
+        LOGGER.debug("Location (index): %s" % location)
+        return location
+    try:
+        sparql_results = sparqlQuery('location', uri, accept_datetime)
+    except SparqlUnavailable:
+        # serve the last known good result (stale-while-error)
+        found, location = negotiation_cache.getStale((uri, accept_datetime),
+                                                     stale_max_age)
+        if not found:
+            raise
+        markStale('negotiation')
+        return location
     location = None
     try:
-        location = sparql_results[0]['successor']['value']
+        location = sparql_results[0]['successor']
     except:
         LOGGER.debug('getLocation: Could not determine redirect location...')
     LOGGER.debug("Location: %s" % location)
+    negotiation_cache.set((uri, accept_datetime), location)
     return location
 
+
+def loadNegotiationTable(uris):
+    """return the negotiation table of the hierarchies below the given uris
+
+    works of the temporal index are not queried again"""
+    table = temporal_index.table
+    missing = [uri for uri in uris if table is None or uri not in table]
+    if not missing:
+        return table
+    loaded = buildNegotiationTable(sparqlValuesQuery('cascade', missing))
+    if table is None:
+        return loaded
+    return collections.ChainMap(loaded, table)
+
+
+def resolveCascade(uri, accept_datetime, table=None):
+    """resolve the cascade of timegates below uri in a single round-trip
+
+    returns the chain of traversed evolutive works (starting with uri) and
+    the final location (None if negotiation fails at some level)"""
+    if table is None:
+        table = loadNegotiationTable([uri])
+    chain = []
+    location = uri
+    while location in table and location not in chain:
+        chain.append(location)
+        location = negotiate(table[location], accept_datetime)
+        if location == None:
+            LOGGER.debug('resolveCascade: Could not determine location...')
+            break
+    LOGGER.debug("Cascade: %s -> %s" % (chain, location))
+    return chain, location
+
+
+@cachedLookup('most_recent', expiring=True)
+def getMostRecent(uri):
+    """resolve the cascade of timegates below uri for the current time
+
+    returns the tuple of resolveCascade. The result changes when new
+    versions are ingested and when the current time passes the date of a
+    member of the chain (consolidated versions may carry future dates), the
+    cached result expires at the next such date"""
+    now = time.strftime("%Y-%m-%dT%XZ")
+    table = loadNegotiationTable([uri])
+    chain, location = resolveCascade(uri, now, table)
+    current = xsdToDatetime(now)
+    upcoming = []
+    for work in chain:
+        dates = table[work][0]
+        pos = bisect.bisect_right(dates, current)
+        if pos < len(dates):
+            upcoming.append(dates[pos])
+    ttl = upcoming and (min(upcoming) - current).total_seconds() or None
+    return (chain, location), ttl
+
+
+def resolveBatch(items):
+    """resolve a list of (index, item) pairs with grouped sparql queries
+
+    every item is negotiated like a ?follow=1 request: through all
+    timegates below its id (below the URI-R for rel=intermediate), using
+    its accept-datetime or now for an original resource; the result holds
+    the final memento, its memento-datetime and the link relations of the
+    traversed resources"""
+    now = time.strftime("%Y-%m-%dT%XZ")
+    results = []
+    pending = []
+    for index, item in items:
+        result = {'index': index, 'id': item['id'],
+                  'datetime': item.get('datetime')}
+        results.append(result)
+        if not isValidId(str(item['id'])):
+            result.update(status=404, error='Invalid celex id')
+            continue
+        try:
+            accept_datetime = item.get('datetime') and \
+                parseHTTPDate(item['datetime']) or None
+        except (ValueError, TypeError, AttributeError):
+            result.update(status=400, error='Invalid datetime')
+            continue
+        pending.append((result, CELLAR_PREFIX + str(item['id']),
+                        item.get('rel') == 'intermediate', accept_datetime))
+    if not pending:
+        return results
+    try:
+        uris_r = getUrisR(list(set([i[1] for i in pending])))
+        starts = []
+        for result, uri, intermediate, accept_datetime in pending:
+            uri_r = uris_r.get(uri) or uri
+            # the original resource always selects the most recent memento
+            if not intermediate and uri == uri_r:
+                accept_datetime = None
+            starts.append((result, uri_r, intermediate and uri_r or uri,
+                           accept_datetime or now))
+        table = loadNegotiationTable(list(set([i[2] for i in starts])))
+        resolved = []
+        for result, uri_r, start, accept_datetime in starts:
+            chain, location = resolveCascade(start, accept_datetime, table)
+            resolved.append((result, uri_r, chain, location))
+        memento_dts = getMementoDatetimes(list(set(
+            [location for result, uri_r, chain, location in resolved
+             if location is not None])))
+    except SparqlQueryError:
+        LOGGER.exception('Resolving batch failed')
+        for result, uri, intermediate, accept_datetime in pending:
+            result.update(status=400, error='Bad Request')
+        return results
+    except Exception:
+        LOGGER.exception('Resolving batch failed')
+        for result, uri, intermediate, accept_datetime in pending:
+            result.update(status=503, error='Service Unavailable')
+        return results
+    for result, uri_r, chain, location in resolved:
+        if location not in memento_dts:
+            result.update(status=404, error='No memento found')
+            continue
+        links = cascadeLinks(uri_r, chain, location)
+        result.update({
+            'status': 200,
+            'memento': toLocalhostUri(location),
+            'data': toLocalhostDataUri(location, '.xml'),
+            'memento_datetime': stringToHTTPDate(memento_dts[location]),
+            'links': {
+                'original': links[0][0],
+                'timegate': [link for link, rel in links
+                             if rel == 'timegate'],
+                'timemap': [link for link, rel in links
+                            if rel == 'timemap'],
+            }})
+    return results
+
+
+def getUrisR(uris):
+    """retrieve the URIs of the related original resources of many uris"""
+    uris_r = {}
+    missing = []
+    for uri in uris:
+        found, uri_r = get_uri_r.cache.get(uri)
+        if found:
+            uris_r[uri] = uri_r
+        else:
+            missing.append(uri)
+    if missing:
+        for i in sparqlValuesQuery('urisR', missing):
+            uris_r.setdefault(i['uri'], i['predecessor'])
+        for uri in missing:
+            uris_r.setdefault(uri, None)
+            get_uri_r.cache.set(uri, uris_r[uri])
+    return uris_r
+
+
+def getMementoDatetimes(uris):
+    """retrieve the memento datetimes of many mementos"""
+    return dict((i['uri'], i['date'])
+                for i in sparqlValuesQuery('mementoDatetimes', uris))
+
+
+@cachedLookup('memento_datetime')
+def getMementoDatetimeValue(uri):
+    """return the memento-datetime of a memento (None if unknown), it
+    never changes"""
+    sparql_results = sparqlQuery('mementoDatetime', uri)
+    if not sparql_results:
+        return None
+    return sparql_results[0]['date']
+
+
+@cachedLookup('predecessor')
 def getPredecessor(uri):
-    query = COMPLEX_WORK_PREDECESSOR_TEMPLATE % {'uri': uri}
-    sparql_results = sparqlQuery(query)
+    sparql_results = sparqlQuery('predecessors', uri)
     predecessor = None
     try:
-        predecessor = sparql_results[0]['predecessor']['value']
+        predecessor = sparql_results[0]['predecessor']
     except:
         LOGGER.debug('getPredecessor: Could not determine predecessor...')
     LOGGER.debug("Predecessor: %s" % predecessor)
     return predecessor
 
 
+def xsdToDatetime(value):
+    """parse a xsd:date or xsd:dateTime value into a naive datetime"""
+    if isinstance(value, datetime.datetime):
+        return value.replace(tzinfo=None)
+    # dates are compared in local time, timezone offsets are ignored
+    return parseXsdDatetime(str(value))[0]
+
+
+def buildNegotiationTable(bindings):
+    """build a table mapping works to their members sorted by date"""
+    rows = {}
+    for binding in bindings:
+        work = binding['work']
+        members = rows.setdefault(work, [])
+        if 'successor' not in binding or 'date' not in binding:
+            continue
+        try:
+            date = xsdToDatetime(binding['date'])
+        except ValueError:
+            LOGGER.debug('Skipping unparsable date: %s' % binding['date'])
+            continue
+        members.append((date, binding['successor']))
+    table = {}
+    for work, members in rows.items():
+        members.sort()
+        table[work] = ([m[0] for m in members], [m[1] for m in members])
+    return table
+
+
+def negotiate(entry, accept_datetime):
+    """return the member with the latest date not after accept_datetime"""
+    dates, successors = entry
+    pos = bisect.bisect_right(dates, xsdToDatetime(accept_datetime))
+    return pos and successors[pos - 1] or None
+
+
+class TemporalIndex(object):
+    """in-memory index of evolutive works for sparql-free negotiation"""
+
+    def __init__(self, page_size=10000):
+        self.page_size = page_size
+        self.table = None
+        self.loaded_at = None
+
+    def load(self):
+        """bulk load all evolutive works and swap in the new table"""
+        bindings = sparqlPagedQuery('temporalIndex', self.page_size)
+        self.table = buildNegotiationTable(bindings)
+        self.loaded_at = time.time()
+        LOGGER.info('Temporal index loaded: %d evolutive works' %
+                    len(self.table))
+
+    def lookup(self, uri, accept_datetime):
+        """return a tuple (indexed, location) for the given uri"""
+        table = self.table
+        if table is None or uri not in table:
+            return False, None
+        return True, negotiate(table[uri], accept_datetime)
+
+    def update(self, uris):
+        """reload the entries of the hierarchies below the given works"""
+        if self.table is None:
+            return
+        loaded = buildNegotiationTable(sparqlValuesQuery('cascade',
+                                                         list(uris)))
+        # readers keep using the old table until the new one is swapped in
+        table = dict(self.table)
+        for uri in uris:
+            table.pop(uri, None)
+        table.update(loaded)
+        self.table = table
+
+
+temporal_index = TemporalIndex(sparql_page_size)
+
+
+def startTemporalIndex(load=True):
+    """load the temporal index and keep refreshing it in the background"""
+    if load:
+        temporal_index.load()
+    if temporal_index_refresh <= 0:
+        return
+
+    def refresh():
+        while True:
+            time.sleep(temporal_index_refresh)
+            try:
+                temporal_index.load()
+            except Exception:
+                LOGGER.exception('Refreshing the temporal index failed')
+    threading.Thread(target=refresh, daemon=True).start()
+
+
+def invalidateWorks(uris):
+    """evict the cached lookups, representations, index entries and
+    timemaps of modified works and of all works above them
+
+    the lookups of the members of a modified work are evicted as well (a
+    new member may have been looked up before it was ingested), so are the
+    timemaps of the works related to a modified work since they link to
+    it; returns the evicted works"""
+    uris = list(uris)
+    if not uris:
+        return []
+    works = set(uris)
+    works.update(i['ancestor'] for i in sparqlValuesQuery('ancestors', uris))
+    members = set(i['member'] for i in sparqlValuesQuery('members', uris))
+    timemaps = set(works)
+    for sparql_results in sparqlQueries([('relatedEvolutiveWorks', (uri,))
+                                         for uri in uris]):
+        timemaps.update(i['evolutive_work'] for i in sparql_results)
+    for uri in works | members:
+        invalidateLookups(uri)
+    representation_cache.invalidateWhere(lambda key: key[0] in works)
+    temporal_index.update(works)
+    timemap_cache.invalidateWhere(lambda key: key[0] in timemaps)
+    if timemap_store is not None:
+        # rebuilt by the next refresh, served live until then
+        for uri in timemaps:
+            timemap_store.remove(uri)
+    evicted = sorted(works | members | timemaps)
+    LOGGER.info('Invalidated %d modified works: %s' % (len(uris),
+                                                        ' '.join(evicted)))
+    return evicted
+
+
+class ChangeMonitor(object):
+    """detect modified works by comparing their timemap fingerprints"""
+
+    def __init__(self):
+        self.fingerprints = None
+
+    def poll(self):
+        """invalidate the works modified since the last poll and return
+        them (the first poll only records the fingerprints)"""
+        fingerprints = getTimemapFingerprints()
+        previous = self.fingerprints
+        modified = []
+        if previous is not None:
+            modified = sorted(uri for uri in set(previous) | set(fingerprints)
+                              if previous.get(uri) != fingerprints.get(uri))
+            invalidateWorks(modified)
+        # modified works are reported again if invalidating them failed
+        self.fingerprints = fingerprints
+        return modified
+
+
+change_monitor = ChangeMonitor()
+
+
+def startChangeMonitor(poll=True):
+    """record the fingerprints and keep polling them in the background"""
+    if invalidation_poll_interval <= 0:
+        return
+    if poll:
+        change_monitor.poll()
+
+    def monitor():
+        while True:
+            time.sleep(invalidation_poll_interval)
+            try:
+                change_monitor.poll()
+            except Exception:
+                LOGGER.exception('Polling for modified works failed')
+    threading.Thread(target=monitor, daemon=True).start()
+
+
+def warmUp(ids, workers=None):
+    """precompute the lookups (and materialized timemaps) of celex ids
+
+    the ids are warmed up concurrently on a dedicated executor, the
+    timemaps of all related works are materialized afterwards; returns the
+    number of ids warmed up successfully"""
+    start = time.time()
+    warmed = 0
+    works = set()
+    with concurrent.futures.ThreadPoolExecutor(
+            max_workers=workers or warmup_workers) as executor:
+        futures = dict((executor.submit(warmUpId, id), id) for id in ids)
+        for future in concurrent.futures.as_completed(futures):
+            try:
+                related = future.result()
+            except Exception:
+                LOGGER.exception('Warming up %s failed' % futures[future])
+                continue
+            if related is not None:
+                warmed += 1
+                works.update(related)
+        if timemap_store is not None:
+            missing = dict((executor.submit(timemap_store.write, work), work)
+                           for work in works if not timemap_store.has(work))
+            for future in concurrent.futures.as_completed(missing):
+                try:
+                    future.result()
+                except Exception as e:
+                    LOGGER.warning('Materializing timemap of %s failed: %r'
+                                   % (missing[future], e))
+    LOGGER.info('Warmed up %d of %d ids in %.1fs' % (
+        warmed, len(futures), time.time() - start))
+    return warmed
+
+
+def warmUpId(id):
+    """precompute URI-R, evolutive work status, predecessor, datetime
+    property and most recent resolution of a celex id
+
+    returns the works whose timemaps are related to the id (None if the id
+    is unknown)"""
+    uri = CELLAR_PREFIX + id
+    uri_r = get_uri_r(uri)
+    if uri_r is None:
+        LOGGER.debug('warmUpId: Unknown id %s' % id)
+        return None
+    works = set([uri_r])
+    for work in set([uri, uri_r]):
+        if isEvolutiveWork(work):
+            getDatetimeProperty(work)
+            works.add(work)
+    if uri not in works:
+        predecessor = getPredecessor(uri)
+        if predecessor is not None:
+            works.add(predecessor)
+    getMostRecent(uri_r)
+    return works
+
+
+def readIds(path):
+    """read celex ids (one per line) from a file"""
+    with open(path) as f:
+        return [line.strip() for line in f
+                if line.strip() and not line.startswith('#')]
+
+
+# request line of an access log entry (common/combined log format)
+ACCESS_LOG_REQUEST = re.compile(
+    r'"(?:GET|HEAD) /(?:memento|data)/([^/?\s"]+?)(?:\.xml|\.txt)?[?\s"]')
+
+
+def topIdsFromLog(path, n=None):
+    """return the n most requested celex ids of an access log"""
+    counter = collections.Counter()
+    with open(path, errors='replace') as f:
+        for line in f:
+            match = ACCESS_LOG_REQUEST.search(line)
+            if match is not None and match.group(1) != 'batch':
+                counter[urllib.parse.unquote(match.group(1))] += 1
+    return [id for id, count in counter.most_common(n or warmup_top)]
+
+
+def isValidId(id):
+    """check whether a celex id can be embedded into the iris of a query"""
+    return bool(id) and INVALID_ID_CHARACTERS.search(id) is None
+
+
+def toValues(uris):
+    """transform a list of uris into the body of a sparql VALUES block"""
+    return ' '.join(['<%s>' % uri for uri in uris])
+
+
 def toCelexUri(uri):
     """transform a local memento uri into celex uri"""
     return uri.replace('memento', CELLAR_PREFIX)
@@ -481,51 +2276,228 @@ def toLocalhostDataUri(uri, fext):
     return uri.replace(CELLAR_PREFIX, '%(localhost)s/data/' % {'localhost': local_host}) + fext
 
 
-def parseHTTPDate(text):
-    """"parse a HTTP-date and returns a datetime object"""
-    # parse UTC datetime from text (value of Accept-Datetime)
-    utc_dt = datetime.datetime(
-        *eut.parsedate(text)[:6], tzinfo=timezone('UTC'))
-    # transform UTC datetime into local time
-    local_dt = utc_dt.astimezone(timezone('Europe/Luxembourg'))
-    # return local datetime without timezone information for further
-    # processing in virtuoso
-    dt = datetime.datetime(local_dt.year, local_dt.month,
-                           local_dt.day, local_dt.hour,
-                           local_dt.minute, local_dt.second)
-    return dt
-
-
-def stringToHTTPDate(text):
-    """convert a xsd:date into an HTTP-date string"""
-    # parse datetime from text (SPARQL result). Supported formats are:
-    # %Y-%m-%d %H:%M:%S and %Y-%m-%d
-    try:
-        dt = datetime.datetime.strptime(text, '%Y-%m-%d %H:%M:%S')
-    except ValueError:
-        dt = datetime.datetime.strptime(text, '%Y-%m-%d')
-    # localize datetime (set timezone to CET/CEST)
-    local_dt = pytz.timezone('Europe/Luxembourg').localize(
-        datetime.datetime(dt.year, dt.month, dt.day, dt.hour, dt.minute, dt.second))
-    # transform localized datetime into UTC datetime
-    utc_dt = local_dt.astimezone(timezone('UTC'))
-    return utc_dt.strftime('%a, %d %b %Y %H:%M:%S') + (' GMT')
+# listener writing the queued log records (None logs synchronously)
+log_listener = None
+
+
+def startLogListener(*handlers):
+    """write log records asynchronously to the given handlers
+
+    request threads only enqueue their records, a listener thread formats
+    and writes them"""
+    global log_listener
+    for handler in LOGGER.handlers[:]:
+        if isinstance(handler, logging.handlers.QueueHandler):
+            LOGGER.removeHandler(handler)
+    log_queue = queue.SimpleQueue()
+    LOGGER.addHandler(logging.handlers.QueueHandler(log_queue))
+    log_listener = logging.handlers.QueueListener(
+        log_queue, *handlers, respect_handler_level=True)
+    log_listener.start()
+    atexit.register(log_listener.stop)
+
+
+def flushLogListener(server=None, worker=None):
+    """write all queued log records and continue with an empty queue
+
+    runs before a worker is forked: a gevent worker inherits the cooperative
+    listener of the master process and would write the pending records a
+    second time"""
+    if log_listener is not None:
+        log_listener.stop()
+        atexit.unregister(log_listener.stop)
+        startLogListener(*log_listener.handlers)
+
+
+def initWorker(worker=None):
+    """create the per-process resources of a forked server worker"""
+    global sparql_backend, sparql_executor, batch_executor, sparql_limiter, \
+        circuit_breaker
+    # pooled connections and threads must not be shared across processes
+    # (the read-only local store is loaded once and shared)
+    if isinstance(sparql_backend, SparqlClient):
+        sparql_backend = createBackend()
+    # the synchronization primitives must be created after patching
+    sparql_limiter, circuit_breaker = createProtection()
+    sparql_executor = concurrent.futures.ThreadPoolExecutor(
+        max_workers=sparql_fanout_workers)
+    batch_executor = concurrent.futures.ThreadPoolExecutor(
+        max_workers=batch_workers)
+    # the listener thread of the master process does not exist in workers
+    if log_listener is not None:
+        startLogListener(*log_listener.handlers)
+    # the index itself has been loaded before forking
+    if temporal_index_enabled:
+        startTemporalIndex(load=False)
+    # the fingerprints have been recorded before forking
+    startChangeMonitor(poll=False)
+
+
+def runServer(bind, workers, worker_class='gevent', worker_connections=1000):
+    """serve the app with pre-forked gunicorn workers
+
+    the app (including the temporal index) is loaded once in the master
+    process and shared by all workers. With the default gevent worker
+    class each worker multiplexes many requests (and their blocking sparql
+    calls) on cooperative greenlets instead of threads"""
+    from gunicorn.app.base import BaseApplication
+
+    options = {
+        'bind': bind,
+        'workers': workers,
+        'worker_class': worker_class,
+        'worker_connections': worker_connections,
+        'preload_app': True,
+        'pre_fork': flushLogListener,
+        # runs after the worker has patched the standard library (gevent)
+        'post_worker_init': initWorker,
+    }
+
+    class MementoApplication(BaseApplication):
+
+        def load_config(self):
+            for key, value in options.items():
+                self.cfg.set(key, value)
+
+        def load(self):
+            return app
+
+    MementoApplication().run()
+
 
 if __name__ == '__main__':
-    logging.basicConfig(level=logging.DEBUG)
+    parser = argparse.ArgumentParser(description='Memento service')
+    parser.add_argument('command', nargs='?', default='serve',
+                        choices=['serve', 'refresh-timemaps', 'warm-up'],
+                        help='run the service (default), refresh the '
+                             'materialized timemaps or only run the warm-up '
+                             'job (e.g. to materialize the timemaps of hot '
+                             'ids)')
+    parser.add_argument('--timemap-store', default=timemap_store_dir,
+                        help='directory of materialized timemaps')
+    parser.add_argument('--timemap-page-size', type=int,
+                        default=timemap_page_size, metavar='MEMENTOS',
+                        help='number of mementos per timemap page (0 '
+                             'disables paging)')
+    parser.add_argument('--full', action='store_true',
+                        help='rebuild all materialized timemaps')
+    parser.add_argument('--store', action='append', default=[],
+                        metavar='FILE',
+                        help='answer all queries from an in-process store '
+                             'loaded from N-Triples files or INSERT dumps '
+                             '(may be repeated) instead of the sparql '
+                             'endpoint')
+    parser.add_argument('--endpoint', default=sparql_endpoint,
+                        help='sparql endpoint answering the queries')
+    parser.add_argument('--prefix', default=CELLAR_PREFIX,
+                        help='namespace of the celex resources')
+    parser.add_argument('--warm-up', action='append', default=[],
+                        metavar='ID',
+                        help='celex id to warm up before serving (may be '
+                             'repeated)')
+    parser.add_argument('--warm-up-file', metavar='FILE',
+                        help='file of celex ids (one per line) to warm up')
+    parser.add_argument('--warm-up-log', metavar='FILE',
+                        help='access log whose most requested ids are '
+                             'warmed up')
+    parser.add_argument('--warm-up-top', type=int, default=warmup_top,
+                        help='number of ids taken from the access log')
+    parser.add_argument('--warm-up-workers', type=int,
+                        default=warmup_workers,
+                        help='number of ids warmed up concurrently')
+    parser.add_argument('--temporal-index', action='store_true',
+                        default=temporal_index_enabled,
+                        help='negotiate datetimes on an in-memory index of '
+                             'all evolutive works')
+    parser.add_argument('--temporal-index-refresh', type=float,
+                        default=temporal_index_refresh, metavar='SECONDS',
+                        help='interval in which the temporal index is '
+                             'reloaded (0 disables reloading, pair the '
+                             'index with --poll-changes then)')
+    parser.add_argument('--poll-changes', type=float,
+                        default=invalidation_poll_interval, metavar='SECONDS',
+                        help='interval in which modified works are detected '
+                             'and evicted from the caches (0 disables '
+                             'polling, the /invalidate webhook is enabled '
+                             'by setting MEMENTO_INVALIDATION_TOKEN)')
+    parser.add_argument('--log-level', default=log_level,
+                        choices=['DEBUG', 'INFO', 'WARNING', 'ERROR'],
+                        help='level of the logged records')
+    parser.add_argument('--bind', default='127.0.0.1:5000',
+                        help='address the production server listens on')
+    parser.add_argument('--workers', type=int, default=0,
+                        help='number of pre-forked worker processes '
+                             '(0 runs the development server)')
+    parser.add_argument('--worker-class', default='gevent',
+                        help='gunicorn worker class (e.g. gevent, gthread)')
+    parser.add_argument('--worker-connections', type=int, default=1000,
+                        help='maximum number of concurrent requests per '
+                             'gevent worker')
+    args = parser.parse_args()
+    if args.timemap_store:
+        timemap_store = TimemapStore(args.timemap_store,
+                                     timemap_store_workers)
     # set logging format
     logFormatter = logging.Formatter(
         "%(asctime)s [%(levelname)-5.5s]  %(message)s")
-    # create LOGGER
-    global LOGGER
-    LOGGER = logging.getLogger()
-    # set up file logging
-    fileHandler = logging.handlers.RotatingFileHandler(
-        "logging.log", maxBytes=1000000000, backupCount=2)
+    # configure LOGGER
+    LOGGER.setLevel(args.log_level)
+    # set up file logging, the worker processes of the production server
+    # append to the same file which must be rotated externally (logrotate)
+    if args.workers > 0:
+        fileHandler = logging.handlers.WatchedFileHandler("logging.log")
+    else:
+        fileHandler = logging.handlers.RotatingFileHandler(
+            "logging.log", maxBytes=1000000000, backupCount=2)
     fileHandler.setFormatter(logFormatter)
-    LOGGER.addHandler(fileHandler)
     # set up console logging
     consoleHandler = logging.StreamHandler()
     consoleHandler.setFormatter(logFormatter)
-    LOGGER.addHandler(consoleHandler)
-    app.run(debug=True)
+    startLogListener(fileHandler, consoleHandler)
+    CELLAR_PREFIX = args.prefix
+    timemap_page_size = args.timemap_page_size
+    invalidation_poll_interval = args.poll_changes
+    temporal_index_enabled = args.temporal_index
+    temporal_index_refresh = args.temporal_index_refresh
+    if temporal_index_enabled and temporal_index_refresh <= 0 and \
+            invalidation_poll_interval <= 0:
+        LOGGER.warning('The temporal index is never reloaded, new members '
+                       'are only negotiated after invalidating their works')
+    sparql_endpoint = args.endpoint
+    local_store_files = args.store
+    sparql_backend = createBackend()
+    if args.store:
+        LOGGER.info('Loaded %d triples into the local store' %
+                    sparql_backend.store.size)
+    warmup_ids = list(args.warm_up)
+    if args.warm_up_file:
+        warmup_ids.extend(readIds(args.warm_up_file))
+    if args.warm_up_log:
+        warmup_ids.extend(topIdsFromLog(args.warm_up_log, args.warm_up_top))
+    warmup_ids = list(collections.OrderedDict.fromkeys(warmup_ids))
+    if args.command == 'refresh-timemaps':
+        if timemap_store is None:
+            parser.error('refresh-timemaps requires --timemap-store')
+        timemap_store.refresh(args.full)
+    elif args.command == 'warm-up':
+        if not warmup_ids:
+            parser.error('warm-up requires --warm-up, --warm-up-file or '
+                         '--warm-up-log')
+        warmUp(warmup_ids, args.warm_up_workers)
+    elif args.workers > 0:
+        if temporal_index_enabled:
+            temporal_index.load()
+        if invalidation_poll_interval > 0:
+            change_monitor.poll()
+        # workers inherit the warm caches of the master process
+        if warmup_ids:
+            warmUp(warmup_ids, args.warm_up_workers)
+        runServer(args.bind, args.workers, args.worker_class,
+                  args.worker_connections)
+    else:
+        if temporal_index_enabled:
+            startTemporalIndex()
+        startChangeMonitor()
+        if warmup_ids:
+            warmUp(warmup_ids, args.warm_up_workers)
+        app.run(debug=True)
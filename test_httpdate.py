@@ -0,0 +1,97 @@
+# Authors: Sebastian Thelen, Patrick Gratz
+# Description: Checks the HTTP-date conversions of httpdate.py against the
+# pytz-based implementation they replace.
+
+import datetime
+import email.utils as eut
+
+import pytest
+
+import httpdate
+
+pytz = pytest.importorskip('pytz')
+
+LUXEMBOURG = pytz.timezone('Europe/Luxembourg')
+
+
+def pytzStringToHTTPDate(text):
+    """previous xsd:date to HTTP-date conversion"""
+    try:
+        dt = datetime.datetime.strptime(text, '%Y-%m-%d %H:%M:%S')
+    except ValueError:
+        dt = datetime.datetime.strptime(text, '%Y-%m-%d')
+    utc_dt = LUXEMBOURG.localize(dt).astimezone(pytz.utc)
+    return utc_dt.strftime('%a, %d %b %Y %H:%M:%S') + ' GMT'
+
+
+def pytzParseHTTPDate(text):
+    """previous HTTP-date parser"""
+    utc_dt = datetime.datetime(*eut.parsedate(text)[:6], tzinfo=pytz.utc)
+    return utc_dt.astimezone(LUXEMBOURG).replace(tzinfo=None)
+
+
+# years whose daylight saving time transitions are checked half-hourly
+DST_YEARS = (2000, 2004, 2008, 2013, 2016)
+
+
+def lastSunday(year, month):
+    day = datetime.datetime(year, month + 1, 1) - datetime.timedelta(days=1)
+    return day - datetime.timedelta(days=(day.weekday() + 1) % 7)
+
+
+def sampleDatetimes():
+    """half hours of the days around the DST transitions and a sample of
+    ordinary datetimes between 2000 and 2016"""
+    for year in DST_YEARS:
+        for month in (3, 10):
+            start = lastSunday(year, month) - datetime.timedelta(days=1)
+            for n in range(3 * 48):
+                yield start + datetime.timedelta(minutes=30 * n)
+    dt = datetime.datetime(2000, 1, 1, 0, 30)
+    while dt.year < 2017:
+        yield dt
+        dt += datetime.timedelta(days=5, hours=7)
+
+
+def testStringToHTTPDateMatchesPytz():
+    for dt in sampleDatetimes():
+        text = dt.strftime('%Y-%m-%d %H:%M:%S')
+        assert httpdate.stringToHTTPDate(text) == pytzStringToHTTPDate(text)
+
+
+def testDateToHTTPDateMatchesPytz():
+    for dt in sampleDatetimes():
+        text = dt.date().isoformat()
+        assert httpdate.stringToHTTPDate(text) == pytzStringToHTTPDate(text)
+
+
+def testParseHTTPDateMatchesPytz():
+    for dt in sampleDatetimes():
+        text = httpdate.formatHTTPDate(dt)
+        assert httpdate.parseHTTPDate(text) == pytzParseHTTPDate(text)
+
+
+def testObsoleteHTTPDateFormats():
+    expected = datetime.datetime(1994, 11, 6, 9, 49, 37)
+    assert httpdate.parseHTTPDate('Sun, 06 Nov 1994 08:49:37 GMT') == \
+        expected
+    assert httpdate.parseHTTPDate('Sunday, 06-Nov-94 08:49:37 GMT') == \
+        expected
+    assert httpdate.parseHTTPDate('Sun Nov  6 08:49:37 1994') == expected
+
+
+def testXsdTimezones():
+    assert httpdate.stringToHTTPDate('2013-06-14T10:00:00Z') == \
+        'Fri, 14 Jun 2013 10:00:00 GMT'
+    assert httpdate.stringToHTTPDate('2013-06-14T10:00:00.250+02:00') == \
+        'Fri, 14 Jun 2013 08:00:00 GMT'
+    assert httpdate.stringToHTTPDate('2013-06-14T10:00:00-01:30') == \
+        'Fri, 14 Jun 2013 11:30:00 GMT'
+
+
+def testInvalidValues():
+    for text in ('2013/06/14', '2013-06-14T10:00', '2013-06-14+2'):
+        with pytest.raises(ValueError):
+            httpdate.parseXsdDatetime(text)
+    with pytest.raises(ValueError):
+        httpdate.parseHTTPDate('yesterday')
@@ -0,0 +1,151 @@
+# Authors: Sebastian Thelen, Patrick Gratz
+# Description: Checks the parser and indexes of localstore.py and that the
+# local store backend answers the backend operations like the sparql client
+# (queried through the stub endpoint of benchmark.py).
+
+import inspect
+import os
+
+import pytest
+import requests
+
+import benchmark
+import localstore
+import memento
+
+DATA = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                    'consolidation_data.txt')
+CELEX = 'http://publications.europa.eu/resource/celex/'
+ROOT = CELEX + '01992L0043'
+WORK_2004 = CELEX + '01992L0043-20040501'
+WORK_2013 = CELEX + '01992L0043-20130701'
+XSD_DATE = localstore.XSD + 'date'
+
+# sample arguments of the backend operations
+ARGUMENTS = {
+    'uri': WORK_2004,
+    'uris': [ROOT, WORK_2004, WORK_2004 + '_0'],
+    'accept_datetime': '2013-01-01T00:00:00',
+    'limit': 10,
+    'offset': 0,
+    'format': 'text/plain',
+}
+# arguments of the operations which only answer for mementos
+MEMENTO_ARGUMENTS = dict(ARGUMENTS, uri=WORK_2004 + '_0')
+
+
+@pytest.fixture(scope='module')
+def backend():
+    return localstore.LocalStoreBackend([DATA])
+
+
+@pytest.fixture(scope='module')
+def client(backend):
+    endpoint = benchmark.StubEndpoint(backend)
+    endpoint.start()
+    yield memento.SparqlClient(endpoint.url, retries=0)
+    endpoint.stop()
+
+
+def testParseNTriples():
+    triples = localstore.parseTriples(
+        '<http://a> <http://p> <http://b> .\n'
+        '# comment\n'
+        '<http://a> <http://p> "x\\"y\\u00e9"@fr-BE .\n'
+        '_:b1 <http://p> "2013-07-01+02:00"^^'
+        '<http://www.w3.org/2001/XMLSchema#date> .\n')
+    assert triples == [
+        ('http://a', 'http://p', 'http://b'),
+        ('http://a', 'http://p', localstore.Literal('x"yé', None,
+                                                    'fr-BE')),
+        ('_:b1', 'http://p', localstore.Literal('2013-07-01+02:00',
+                                                XSD_DATE))]
+
+
+def testParseTurtleAbbreviations():
+    triples = localstore.parseTriples(
+        '@prefix ex: <http://example.org/> .\n'
+        'ex:a a ex:Work ; ex:member ex:b , ex:c ; '
+        'ex:date "2004-05-01"^^xsd:date ; ex:count 2 .')
+    assert triples == [
+        ('http://example.org/a', localstore.RDF_TYPE,
+         'http://example.org/Work'),
+        ('http://example.org/a', 'http://example.org/member',
+         'http://example.org/b'),
+        ('http://example.org/a', 'http://example.org/member',
+         'http://example.org/c'),
+        ('http://example.org/a', 'http://example.org/date',
+         localstore.Literal('2004-05-01', XSD_DATE)),
+        ('http://example.org/a', 'http://example.org/count',
+         localstore.Literal('2', localstore.XSD + 'integer'))]
+
+
+def testParseInsertDump():
+    triples = localstore.parseTriples(
+        'PREFIX cdm: <http://publications.europa.eu/ontology/cdm#> '
+        'INSERT IN GRAPH <http://consolidation/test> { '
+        '<http://a> cdm:complex_work_has_member_work <http://b> . }')
+    assert triples == [('http://a', localstore.HAS_MEMBER, 'http://b')]
+
+
+def testParseErrors():
+    for text in ('<http://a> <http://p> .', '<http://a> <http://p> ?x .',
+                 'ex:a ex:p ex:b .', 'select * where { }'):
+        with pytest.raises(ValueError):
+            localstore.parseTriples(text)
+
+
+def testHierarchy(backend):
+    store = backend.store
+    assert store.size == 20
+    assert store.evolutiveWorks() == [ROOT, WORK_2004, WORK_2013]
+    assert store.roots(WORK_2004 + '_1') == [ROOT]
+    assert store.ancestors(WORK_2004 + '_1') == [WORK_2004 + '_1',
+                                                 WORK_2004, ROOT]
+    assert set(store.descendants(ROOT)) == set([
+        ROOT, WORK_2004, WORK_2013, WORK_2004 + '_0', WORK_2004 + '_1',
+        WORK_2013 + '_0', WORK_2013 + '_1'])
+    assert store.mementoDatetimes(WORK_2004 + '_0') == [
+        localstore.Literal('2012-06-14+02:00', XSD_DATE)]
+
+
+def testAllTemplatesAreMapped():
+    templates = sorted(
+        name for name, value in vars(memento).items()
+        if name.isupper() and isinstance(value, str) and
+        ('select' in value.lower() or 'describe' in value.lower()))
+    assert templates == sorted(name for name, operation in
+                               benchmark.OPERATIONS)
+
+
+@pytest.mark.parametrize('name, operation', benchmark.OPERATIONS)
+def testBackendsAnswerTheSameOperations(backend, client, name, operation):
+    parameters = inspect.signature(
+        getattr(memento.SparqlClient, operation)).parameters
+    arguments = operation == 'mementoDatetime' and MEMENTO_ARGUMENTS or \
+        ARGUMENTS
+    args = [arguments[parameter] for parameter in list(parameters)[1:]]
+    expected = getattr(backend, operation)(*args)
+    assert getattr(client, operation)(*args) == expected
+    if operation != 'describe':
+        assert expected
+
+
+def testAnswers(backend):
+    def values(rows, name):
+        return [row[name] for row in rows]
+    assert values(backend.uriR(WORK_2004 + '_1'), 'predecessor') == [ROOT]
+    assert values(backend.location(WORK_2004, '2013-01-01T00:00:00'),
+                  'successor') == [WORK_2004 + '_0']
+    assert values(backend.predecessors(WORK_2013), 'predecessor') == [ROOT]
+    assert values(backend.ancestors([WORK_2013 + '_0']), 'ancestor') == [
+        WORK_2013 + '_0', WORK_2013, ROOT]
+    assert values(backend.mementoDatetime(WORK_2004 + '_0'), 'date') == [
+        '2012-06-14+02:00']
+
+
+def testUnknownQueries(backend, client):
+    with pytest.raises(requests.HTTPError):
+        client.query('select * where { ?s ?p ?o }')
+    with pytest.raises(ValueError):
+        backend.describe(ROOT, 'text/csv')